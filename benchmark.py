@@ -0,0 +1,573 @@
+import argparse, contextlib, io, json, math, os, queue, socket, sys, tempfile, threading, time, types
+import numpy as np
+import pandas as pd
+
+try:
+    import settings
+except ModuleNotFoundError:
+    # The benchmarks never talk to Google, so an empty settings module is enough to import main
+    sys.modules["settings"] = types.ModuleType("settings")
+import main
+import fake_google
+
+UNITS = ["%", "Average", "Count", "Rupiah"]
+
+def convert_value_dataframe_rowwise(cleaned_data:pd.DataFrame):
+    # Reference implementation: the row-wise apply that convert_value_dataframe replaced
+    def preprocess_value(unit, value):
+        if isinstance(value, float) and math.isnan(value) : return np.nan
+        if value == "-" : return np.nan
+        match unit:
+            case "%":
+                return str(value).replace(",", ".")
+            case "Average":
+                return str(value).replace(",", ".")
+            case "Count":
+                try:
+                    return int(value)
+                except ValueError:
+                    return str(value).replace(".", "").replace(",", "")
+            case "Rupiah":
+                return str(value).replace("", "")
+            case _:
+                raise Exception(f"Invalid Unit '{unit}'")
+
+    converted_result = cleaned_data.copy(deep=True)
+    converted_result.Value = converted_result.apply(lambda row: preprocess_value(row.Unit, row.Value), axis=1).astype(float)
+
+    return converted_result
+
+def make_unconverted_data(rows:int, seed:int=0) -> pd.DataFrame:
+    # Mimics the left-merged frame: an object Value column mixing numbers, localized text, "-" and NaN
+    rng = np.random.default_rng(seed)
+    units = rng.choice(UNITS, size=rows)
+    numbers = np.round(rng.uniform(-1000, 100000, size=rows) * 100) / 100
+    kind = rng.integers(0, 6, size=rows)
+    values = np.empty(rows, dtype=object)
+    values[kind == 0] = np.nan
+    values[kind == 1] = "-"
+    values[kind == 2] = numbers[kind == 2]
+    values[kind == 3] = numbers[kind == 3].astype(np.int64).tolist()
+    values[kind == 4] = [f"{number:.2f}".replace(".", ",") for number in numbers[kind == 4]]
+    values[kind == 5] = [f"{int(number):,}".replace(",", ".") for number in numbers[kind == 5]]
+    # Only "Count" knows how to read thousand separators
+    dotted = (kind == 5) & (units != "Count")
+    values[dotted] = numbers[dotted].astype(np.int64).astype(str)
+    comma = (kind == 4) & (units == "Rupiah")
+    values[comma] = numbers[comma].astype(str)
+    return pd.DataFrame({"Area Code": "01",
+                         "Area": "ACEH",
+                         "Indicator Code": "IDX",
+                         "Indicator Name": "Indicator",
+                         "Unit": units,
+                         "Year": "2020",
+                         "Value": values})
+
+def assert_bit_identical(expected:pd.DataFrame, actual:pd.DataFrame):
+    pd.testing.assert_frame_equal(expected.drop(columns="Value"), actual.drop(columns="Value"))
+    if not np.array_equal(expected.Value.to_numpy(dtype=float).view(np.int64),
+                          actual.Value.to_numpy(dtype=float).view(np.int64)):
+        raise AssertionError("Converted values differ from the row-wise implementation")
+
+def time_call(func, *args, repeat:int=1):
+    timings = list()
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings), result
+
+def benchmark_convert_value(sizes:list[int], repeat:int=1) -> list[dict]:
+    results = list()
+    for rows in sizes:
+        data = make_unconverted_data(rows)
+        rowwise_seconds, expected = time_call(convert_value_dataframe_rowwise, data, repeat=repeat)
+        vectorized_seconds, actual = time_call(main.convert_value_dataframe, data, repeat=repeat)
+        assert_bit_identical(expected, actual)
+        results.append({"benchmark": "convert_value_dataframe",
+                        "rows": rows,
+                        "rowwise_seconds": rowwise_seconds,
+                        "vectorized_seconds": vectorized_seconds,
+                        "speedup": rowwise_seconds / vectorized_seconds})
+        print(f"{rows:>9} ROWS | ROW-WISE {rowwise_seconds:8.3f}s | VECTORIZED {vectorized_seconds:8.3f}s | {rowwise_seconds / vectorized_seconds:6.1f}x")
+    return results
+
+AREA_HEADER = ["ID", "AREA_NAME", "AREA_TYPE", "REGION_GROUP", "ID_REGION"]
+INCOME_HEADER = ["Provinsi", "Tingkat_Pendapatan", "ID_Pendapatan"]
+YEAR_HEADER = ["Year", "Notes"]
+INDICATOR_HEADER = ["Indicator_Code", "Indicator_Name", "Category_ID", "Category", "Sub_Category_ID", "Sub_Category",
+                    "Area_ID", "Area_Type", "Unit", "Threshold Grade A", "Threshold Grade B", "Threshold Grade C"]
+CLEANED_DATA_FOLDER_ID = "fake-cleaned-data-folder"
+
+def synthetic_value(rng:np.random.Generator, unit:str):
+    # Raw sheet cells as the cleaned files hold them: numbers, localized text, "-" and blanks
+    kind = rng.integers(0, 10)
+    if kind == 0:
+        return ""
+    if kind == 1:
+        return "-"
+    match unit:
+        case "Count":
+            if kind == 4:
+                # A fraction, truncated by the Count converter
+                return round(float(rng.uniform(0, 1_000)), 1)
+            if kind == 5:
+                # Large enough to be displayed with an exponent ("1.5e+17")
+                return float(f"{rng.uniform(1, 10):.1f}e{rng.integers(16, 18)}")
+            number = int(rng.integers(0, 5_000_000))
+            return f"{number:,}".replace(",", ".") if kind < 4 else number
+        case "Rupiah":
+            return round(float(rng.uniform(0, 10_000_000)), 2)
+        case _:
+            number = round(float(rng.uniform(0, 100)), 2)
+            return f"{number}".replace(".", ",") if kind < 4 else number
+
+def generate_dataset(backend:fake_google.FakeGoogleBackend,
+                     provinces:int,
+                     indicators:int,
+                     years:int,
+                     source_files:int,
+                     seed:int=0,
+                     extra_columns:int=0,
+                     tenant:str=None) -> dict:
+    """Fills the fake backend with master sheets, cleaned files and an empty warehouse, returns the matching settings.
+
+    extra_columns adds that many text columns the pipeline does not use to every cleaned file (wide sheets).
+    With tenant, the cleaned data folder, its files and the warehouse get their own ids, so several tenants
+    can share one backend and its master sheets.
+    """
+    suffix = f"-{tenant}" if tenant else ""
+    rng = np.random.default_rng(seed)
+    year_labels = [str(2018 + offset) for offset in range(years)]
+    areas = [[0, "INDONESIA", "Country", "INDONESIA", 0]] + [
+        [number, f"PROVINCE {number:02d}", "Province", f"REGION {number % 5 + 1}", number % 5 + 1]
+        for number in range(1, provinces + 1)]
+    income_levels = ["Low", "Lower Middle", "Upper Middle", "High"]
+    incomes = [[area[1], income_levels[number % 4], number % 4 + 1] for number, area in enumerate(areas[1:])]
+    indicator_rows = list()
+    for number in range(1, indicators + 1):
+        unit = UNITS[number % len(UNITS)]
+        scale = {"Count": 5_000_000, "Rupiah": 10_000_000}.get(unit, 100)
+        indicator_rows.append([f"IND{number:04d}", f"Indicator {number}", number % 7 + 1, f"Category {number % 7 + 1}",
+                               number % 21 + 1, f"Sub Category {number % 21 + 1}", 1, "Province", unit,
+                               scale * 0.75, scale * 0.5, scale * 0.25])
+    ids = {"MASTER_AREA_SPSID": "fake-master-area",
+           "MASTER_INCOME_PROVINCE_SPSID": "fake-master-income-province",
+           "MASTER_YEAR_SPSID": "fake-master-year",
+           "MASTER_INDICATOR_SPSID": "fake-master-indicator",
+           "WAREHOUSE_DATA_SPS_ID": f"fake-warehouse{suffix}",
+           "MERGED_DATA_SPS_ID": f"fake-merged-data{suffix}",
+           "CLEANED_DATA_DRIVE_FOLDER": f"{CLEANED_DATA_FOLDER_ID}{suffix}",
+           "MASTER_WORKSHEET": "main"}
+    # Tenants share the master sheets, the first one creates them
+    if ids["MASTER_AREA_SPSID"] not in backend.files:
+        backend.add_spreadsheet(ids["MASTER_AREA_SPSID"], "master_area", {"main": [AREA_HEADER] + areas})
+        backend.add_spreadsheet(ids["MASTER_INCOME_PROVINCE_SPSID"], "master_income_province", {"main": [INCOME_HEADER] + incomes})
+        backend.add_spreadsheet(ids["MASTER_YEAR_SPSID"], "master_year",
+                                {"main": [YEAR_HEADER] + [[int(year), f"Year {year}"] for year in year_labels]})
+        backend.add_spreadsheet(ids["MASTER_INDICATOR_SPSID"], "master_indicator", {"main": [INDICATOR_HEADER] + indicator_rows})
+    # Every source file covers a slice of the indicators for all areas
+    for file_number, file_indicators in enumerate(np.array_split(np.array(indicator_rows, dtype=object), source_files), start=1):
+        rows = [["Province", "Indicator ID"] + year_labels + [f"Note {number}" for number in range(1, extra_columns + 1)]]
+        for area in areas:
+            for indicator in file_indicators:
+                rows.append([area[1], indicator[0]] + [synthetic_value(rng, indicator[8]) for _ in year_labels]
+                            + [f"source note {number} for {indicator[0]}" for number in range(1, extra_columns + 1)])
+        backend.add_spreadsheet(f"fake-cleaned{suffix}-{file_number:04d}", f"source {file_number:04d} cleaned", {"main": rows},
+                                parent=ids["CLEANED_DATA_DRIVE_FOLDER"])
+    backend.add_spreadsheet(ids["WAREHOUSE_DATA_SPS_ID"], "warehouse",
+                            {table: [columns] for table, columns in main.WAREHOUSE_COLUMNS.items()},
+                            row_count=1000, col_count=26)
+    backend.add_spreadsheet(ids["MERGED_DATA_SPS_ID"], "merged data", {"main": []}, row_count=1000, col_count=26)
+    return ids
+
+def change_cells(backend:fake_google.FakeGoogleBackend, ids:dict, count:int, rng:np.random.Generator) -> int:
+    """Overwrites count random value cells of the cleaned files, like edits in the Sheets UI, returns the files touched."""
+    units = {row[0]: row[8] for row in backend.spreadsheet_data(ids["MASTER_INDICATOR_SPSID"]).sheets[0].grid()[1:]}
+    files = sorted(file["id"] for file in backend.files.values() if ids["CLEANED_DATA_DRIVE_FOLDER"] in file["parents"])
+    touched = set()
+    for _ in range(count):
+        sps_id = files[rng.integers(0, len(files))]
+        sheet = backend.spreadsheet_data(sps_id).sheets[0]
+        header = sheet.grid()[0]
+        row = int(rng.integers(1, sheet.row_count))
+        col = int(rng.integers(2, 2 + len(main.get_year_columns(pd.DataFrame(columns=header)))))
+        with backend.lock:
+            value = synthetic_value(rng, units[sheet.cells[(row, 1)]])
+            if value == "":
+                sheet.cells.pop((row, col), None)
+            else:
+                sheet.cells[(row, col)] = value
+        touched.add(sps_id)
+    for sps_id in touched:
+        backend.touch(sps_id)
+    return len(touched)
+
+@contextlib.contextmanager
+def patched_attributes(target, **attributes):
+    missing = object()
+    originals = {name: getattr(target, name, missing) for name in attributes}
+    for name, value in attributes.items():
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            if value is missing:
+                delattr(target, name)
+            else:
+                setattr(target, name, value)
+
+def benchmark_extract(provinces:int,
+                      indicators:int,
+                      years:int,
+                      source_files:int,
+                      extra_columns:int=0,
+                      latency:float=0.0,
+                      seed:int=0) -> list[dict]:
+    """Reads the same cleaned files through both extraction engines, cold, and checks they give the same text."""
+    backend = fake_google.FakeGoogleBackend(latency=latency, seed=seed, on_transfer=main.RUN_METRICS.record_transfer)
+    ids = generate_dataset(backend, provinces, indicators, years, source_files, seed=seed, extra_columns=extra_columns)
+    results, frames = list(), dict()
+    for engine in ("gspread", "csv"):
+        with tempfile.TemporaryDirectory() as workdir, \
+             patched_attributes(main.settings, **ids, EXTRACT_ENGINE=engine, SNAPSHOT_CACHE_DIR=workdir), \
+             patched_attributes(main,
+                                sheets_client=backend.sheets_client,
+                                drive_service=backend.drive_service,
+                                SHEETS_READ_LIMITER=main.RateLimiter(60_000, burst=1000)), \
+             contextlib.redirect_stdout(io.StringIO()):
+            main.RUN_METRICS.reset()
+            seconds, frames[engine] = time_call(lambda: main.concatenate_cleaned_data(
+                main.get_all_cleaned_data(None, ids["CLEANED_DATA_DRIVE_FOLDER"])))
+        results.append({"benchmark": "extract",
+                        "engine": engine,
+                        "rows": len(frames[engine]),
+                        "extra_columns": extra_columns,
+                        "seconds": seconds,
+                        "bytes_received": main.RUN_METRICS.transfers["sheets"]["bytes_received"]})
+        print(f"{engine:>8} | {len(frames[engine]):>9} ROWS | {seconds:8.3f}s | {results[-1]['bytes_received'] / 1e6:8.2f} MB RECEIVED")
+    # The CSV engine reads every value as text, the gspread engine keeps numbers as numbers
+    pd.testing.assert_frame_equal(frames["gspread"].astype(str), frames["csv"].astype(str))
+    # Equal text can still convert differently (the number 12.7 against the text "12.7"), so the values are compared too
+    units = {row[0]: row[8] for row in backend.spreadsheet_data(ids["MASTER_INDICATOR_SPSID"]).sheets[0].grid()[1:]}
+    values = dict()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for engine, frame in frames.items():
+            melted_df = main.melt_cleaned_data(frame)
+            melted_df["Unit"] = melted_df["Indicator Code"].map(units)
+            values[engine] = main.convert_value_dataframe(melted_df).Value
+    pd.testing.assert_series_equal(values["gspread"], values["csv"])
+    return results
+
+def benchmark_pipeline(provinces:int,
+                       indicators:int,
+                       years:int,
+                       source_files:int,
+                       runs:int=1,
+                       latency:float=0.0,
+                       quota_error_rate:float=0.0,
+                       read_quota:int=6000,
+                       backoff_base:float=0.01,
+                       max_workers:int=1,
+                       engine:str="gspread",
+                       changed_cells:int=0,
+                       seed:int=0,
+                       verbose:bool=False) -> dict:
+    """Runs the whole pipeline against the fake Google backend, runs after the first are warm (snapshots, no-op diffs).
+
+    Before every warm run, changed_cells random value cells of the cleaned files are edited.
+    """
+    backend = fake_google.FakeGoogleBackend(latency=latency, quota_error_rate=quota_error_rate, seed=seed,
+                                            on_transfer=main.RUN_METRICS.record_transfer)
+    ids = generate_dataset(backend, provinces, indicators, years, source_files, seed=seed)
+    results = {"benchmark": "pipeline",
+               "config": {"provinces": provinces, "indicators": indicators, "years": years, "source_files": source_files,
+                          "latency": latency, "quota_error_rate": quota_error_rate, "read_quota": read_quota,
+                          "backoff_base": backoff_base, "max_workers": max_workers, "engine": engine,
+                          "changed_cells": changed_cells, "seed": seed},
+               "runs": list()}
+    with tempfile.TemporaryDirectory() as workdir, \
+         patched_attributes(main.settings,
+                            **ids,
+                            DEFAULT_NULL_VALUE="-",
+                            PUBLISH_MERGED_DATA=True,
+                            EXTRACT_ENGINE=engine,
+                            BACKOFF_BASE_SECONDS=backoff_base,
+                            SNAPSHOT_CACHE_DIR=os.path.join(workdir, "snapshots"),
+                            LOAD_CHECKPOINT_DIR=os.path.join(workdir, "checkpoints"),
+                            CDC_STATE_DIR=os.path.join(workdir, "cdc")), \
+         patched_attributes(main,
+                            sheets_client=backend.sheets_client,
+                            drive_service=backend.drive_service,
+                            SHEETS_READ_LIMITER=main.RateLimiter(read_quota, burst=max(1, read_quota // 60))):
+        rng = np.random.default_rng(seed + 1)
+        for run in range(1, runs + 1):
+            touched_files = change_cells(backend, ids, changed_cells, rng) if run > 1 else 0
+            main.RUN_METRICS.reset()
+            calls_before, quota_errors_before = backend.calls.copy(), backend.quota_errors
+            stages = main.build_pipeline(None,
+                                         main.GoogleSheetsSink(None, ids["WAREHOUSE_DATA_SPS_ID"]),
+                                         main.GoogleSheetsSink(None, ids["MERGED_DATA_SPS_ID"]),
+                                         "main")
+            started_at = time.perf_counter()
+            with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+                stage_results = main.run_stages(stages,
+                                                os.path.join(workdir, f"stages-{run}"),
+                                                max_workers=max_workers)
+            total_seconds = time.perf_counter() - started_at
+            results["runs"].append({"run": run,
+                                    "total_seconds": total_seconds,
+                                    "touched_files": touched_files,
+                                    "api_calls": dict(backend.calls - calls_before),
+                                    "quota_errors": backend.quota_errors - quota_errors_before,
+                                    "merged_rows": len(stage_results["converted"]),
+                                    "fact_rows": len(stage_results["fact_value"]),
+                                    "metrics": main.RUN_METRICS.to_dict()})
+            print(f"RUN {run} | {total_seconds:8.3f}s | {sum((backend.calls - calls_before).values())} API CALLS | "
+                  f"{backend.quota_errors - quota_errors_before} QUOTA ERRORS | {len(stage_results['fact_value'])} FACT ROWS")
+    return results
+
+def free_port() -> int:
+    with contextlib.closing(socket.socket()) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def benchmark_watch(provinces:int,
+                    indicators:int,
+                    years:int,
+                    source_files:int,
+                    edits:int=3,
+                    changed_cells:int=10,
+                    poll_seconds:float=1.0,
+                    debounce_seconds:float=0.5,
+                    push:bool=False,
+                    seed:int=0,
+                    verbose:bool=False) -> dict:
+    """Runs the watch mode against the fake Drive changes feed and times every edit until the warehouse is refreshed.
+
+    Every edit is a burst of changed_cells cell edits. With push, changes arrive as push notifications on a local
+    port and the feed is polled only once a minute otherwise.
+    """
+    backend = fake_google.FakeGoogleBackend(seed=seed, on_transfer=main.RUN_METRICS.record_transfer)
+    ids = generate_dataset(backend, provinces, indicators, years, source_files, seed=seed)
+    port = free_port()
+    results = {"benchmark": "watch",
+               "config": {"provinces": provinces, "indicators": indicators, "years": years, "source_files": source_files,
+                          "edits": edits, "changed_cells": changed_cells, "poll_seconds": poll_seconds,
+                          "debounce_seconds": debounce_seconds, "push": push, "seed": seed},
+               "edits": list()}
+    runs = queue.Queue()
+    stop = threading.Event()
+    with tempfile.TemporaryDirectory() as workdir, \
+         patched_attributes(main.settings,
+                            **ids,
+                            DEFAULT_NULL_VALUE="-",
+                            PUBLISH_MERGED_DATA=True,
+                            SNAPSHOT_CACHE_DIR=os.path.join(workdir, "snapshots"),
+                            LOAD_CHECKPOINT_DIR=os.path.join(workdir, "checkpoints"),
+                            CDC_STATE_DIR=os.path.join(workdir, "cdc"),
+                            WATCH_STATE_PATH=os.path.join(workdir, "watch.json"),
+                            WATCH_POLL_SECONDS=60.0 if push else poll_seconds,
+                            WATCH_DEBOUNCE_SECONDS=debounce_seconds,
+                            WATCH_MAX_DELAY_SECONDS=10 * debounce_seconds,
+                            WATCH_WEBHOOK_URL=f"http://127.0.0.1:{port}/" if push else None,
+                            WATCH_WEBHOOK_PORT=port), \
+         patched_attributes(main,
+                            sheets_client=backend.sheets_client,
+                            drive_service=backend.drive_service,
+                            SHEETS_READ_LIMITER=main.RateLimiter(6000, burst=100)), \
+         contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        watcher = threading.Thread(target=main.watch_pipeline,
+                                   args=(None,
+                                         main.GoogleSheetsSink(None, ids["WAREHOUSE_DATA_SPS_ID"]),
+                                         main.GoogleSheetsSink(None, ids["MERGED_DATA_SPS_ID"]),
+                                         "main",
+                                         os.path.join(workdir, "stages"),
+                                         os.path.join(workdir, "metrics")),
+                                   kwargs={"max_workers": 1, "stop": stop,
+                                           "on_run": lambda stale_stages, seconds, error: runs.put((stale_stages, seconds, error))})
+        watcher.start()
+        try:
+            runs.get(timeout=600)
+            rng = np.random.default_rng(seed + 1)
+            for edit in range(1, edits + 1):
+                calls_before = backend.calls.copy()
+                edited_at = time.perf_counter()
+                change_cells(backend, ids, changed_cells, rng)
+                stale_stages, run_seconds, error = runs.get(timeout=600)
+                if error is not None:
+                    raise error
+                latency = time.perf_counter() - edited_at
+                results["edits"].append({"edit": edit,
+                                         "latency_seconds": latency,
+                                         "run_seconds": run_seconds,
+                                         "stale_stages": sorted(stale_stages),
+                                         "api_calls": dict(backend.calls - calls_before)})
+                print(f"EDIT {edit} | {latency:7.2f}s TO WAREHOUSE | RUN {run_seconds:7.2f}s | "
+                      f"{sum((backend.calls - calls_before).values())} API CALLS", file=sys.__stdout__)
+            # Quota spent while nothing changes
+            calls_before = backend.calls.copy()
+            time.sleep(3 * poll_seconds)
+            results["idle_api_calls"] = dict(backend.calls - calls_before)
+            print(f"IDLE {3 * poll_seconds:.1f}s | {sum(results['idle_api_calls'].values())} API CALLS", file=sys.__stdout__)
+        finally:
+            stop.set()
+            watcher.join()
+    return results
+
+def benchmark_batch(tenants:int,
+                    provinces:int,
+                    indicators:int,
+                    years:int,
+                    source_files:int,
+                    latency:float=0.0,
+                    read_quota:int=6000,
+                    max_pipelines:int=4,
+                    seed:int=0,
+                    verbose:bool=False) -> dict:
+    """Runs several warehouses one after the other, as separate processes would, then as one batch.
+
+    Every tenant has its own cleaned data folder and warehouse, all of them use the same master sheets.
+    """
+    results = {"benchmark": "batch",
+               "config": {"tenants": tenants, "provinces": provinces, "indicators": indicators, "years": years,
+                          "source_files": source_files, "latency": latency, "read_quota": read_quota,
+                          "max_pipelines": max_pipelines, "seed": seed},
+               "modes": list()}
+    for mode in ("separate", "batch"):
+        backend = fake_google.FakeGoogleBackend(latency=latency, seed=seed)
+        tenant_ids = [generate_dataset(backend, provinces, indicators, years, source_files, seed=seed + number, tenant=f"t{number}")
+                      for number in range(1, tenants + 1)]
+        with tempfile.TemporaryDirectory() as workdir, \
+             patched_attributes(main.settings,
+                                **{key: value for key, value in tenant_ids[0].items() if key.startswith("MASTER")},
+                                DEFAULT_NULL_VALUE="-",
+                                PUBLISH_MERGED_DATA=True,
+                                SNAPSHOT_CACHE_DIR=os.path.join(workdir, "snapshots"),
+                                STAGE_CHECKPOINT_DIR=os.path.join(workdir, "stages"),
+                                LOAD_CHECKPOINT_DIR=os.path.join(workdir, "checkpoints"),
+                                CDC_STATE_DIR=os.path.join(workdir, "cdc"),
+                                VALIDATION_REPORT_PATH=os.path.join(workdir, "validation_report.csv")), \
+             patched_attributes(main,
+                                sheets_client=backend.sheets_client,
+                                drive_service=backend.drive_service,
+                                SHEETS_READ_LIMITER=main.RateLimiter(read_quota, burst=max(1, read_quota // 60))), \
+             contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+            configs = [main.PipelineConfig(f"t{number}",
+                                           CLEANED_DATA_DRIVE_FOLDER=ids["CLEANED_DATA_DRIVE_FOLDER"],
+                                           WAREHOUSE_DATA_SPS_ID=ids["WAREHOUSE_DATA_SPS_ID"],
+                                           MERGED_DATA_SPS_ID=ids["MERGED_DATA_SPS_ID"])
+                       for number, ids in enumerate(tenant_ids, start=1)]
+            started_at = time.perf_counter()
+            if mode == "separate":
+                summaries = [summary for config in configs
+                             for summary in main.run_batch(None, [config], os.path.join(workdir, "metrics"), max_pipelines=1)]
+            else:
+                summaries = main.run_batch(None, configs, os.path.join(workdir, "metrics"), max_pipelines=max_pipelines)
+            total_seconds = time.perf_counter() - started_at
+        failed = [summary for summary in summaries if summary["status"] != "succeeded"]
+        if failed:
+            raise Exception(f"Pipelines failed: {failed}")
+        results["modes"].append({"mode": mode,
+                                 "total_seconds": total_seconds,
+                                 "api_calls": dict(backend.calls),
+                                 "pipelines": summaries})
+        print(f"{mode:>8} | {tenants} WAREHOUSES | {total_seconds:8.3f}s | {sum(backend.calls.values())} API CALLS | "
+              f"{backend.calls['values_batch_get']} MASTER BATCH READS")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the ETL pipeline")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    convert_parser = subparsers.add_parser("convert", help="row-wise against vectorized value conversion")
+    convert_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    convert_parser.add_argument("--repeat", type=int, default=1)
+    extract_parser = subparsers.add_parser("extract", help="gspread against CSV export extraction of the cleaned files")
+    extract_parser.add_argument("--provinces", type=int, default=38)
+    extract_parser.add_argument("--indicators", type=int, default=1000)
+    extract_parser.add_argument("--years", type=int, default=6)
+    extract_parser.add_argument("--files", type=int, default=20, help="number of cleaned source files")
+    extract_parser.add_argument("--extra-columns", type=int, default=0, help="unused text columns in every cleaned file")
+    extract_parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake API call")
+    extract_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser = subparsers.add_parser("pipeline", help="the whole pipeline on synthetic data behind a fake Google backend")
+    pipeline_parser.add_argument("--provinces", type=int, default=38)
+    pipeline_parser.add_argument("--indicators", type=int, default=100)
+    pipeline_parser.add_argument("--years", type=int, default=6)
+    pipeline_parser.add_argument("--files", type=int, default=20, help="number of cleaned source files")
+    pipeline_parser.add_argument("--runs", type=int, default=2, help="runs after the first measure the warm path")
+    pipeline_parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake API call")
+    pipeline_parser.add_argument("--quota-error-rate", type=float, default=0.0, help="share of API calls failing with 429")
+    pipeline_parser.add_argument("--read-quota", type=int, default=6000, help="read requests per minute")
+    pipeline_parser.add_argument("--backoff-base", type=float, default=0.01, help="first retry delay in seconds")
+    pipeline_parser.add_argument("--max-workers", type=int, default=1, help="stages run in parallel")
+    pipeline_parser.add_argument("--engine", choices=["gspread", "csv"], default="gspread", help="extraction engine")
+    pipeline_parser.add_argument("--changed-cells", type=int, default=0, help="value cells edited before every warm run")
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    watch_parser = subparsers.add_parser("watch", help="edit-to-warehouse latency of the watch mode against a fake Drive changes feed")
+    watch_parser.add_argument("--provinces", type=int, default=38)
+    watch_parser.add_argument("--indicators", type=int, default=100)
+    watch_parser.add_argument("--years", type=int, default=6)
+    watch_parser.add_argument("--files", type=int, default=20, help="number of cleaned source files")
+    watch_parser.add_argument("--edits", type=int, default=3, help="bursts of edits, each waited for")
+    watch_parser.add_argument("--changed-cells", type=int, default=10, help="value cells edited per burst")
+    watch_parser.add_argument("--poll-seconds", type=float, default=1.0)
+    watch_parser.add_argument("--debounce-seconds", type=float, default=0.5)
+    watch_parser.add_argument("--push", action="store_true", help="wake up on push notifications instead of polling")
+    watch_parser.add_argument("--seed", type=int, default=0)
+    watch_parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    batch_parser = subparsers.add_parser("batch", help="several warehouses run separately against one batch")
+    batch_parser.add_argument("--tenants", type=int, default=4, help="number of warehouses")
+    batch_parser.add_argument("--provinces", type=int, default=38)
+    batch_parser.add_argument("--indicators", type=int, default=100)
+    batch_parser.add_argument("--years", type=int, default=6)
+    batch_parser.add_argument("--files", type=int, default=5, help="number of cleaned source files per warehouse")
+    batch_parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every fake API call")
+    batch_parser.add_argument("--read-quota", type=int, default=6000, help="read requests per minute")
+    batch_parser.add_argument("--max-pipelines", type=int, default=4, help="warehouses run at the same time")
+    batch_parser.add_argument("--seed", type=int, default=0)
+    batch_parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    for subparser in (convert_parser, extract_parser, pipeline_parser, watch_parser, batch_parser):
+        subparser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.benchmark == "convert":
+        results = benchmark_convert_value(args.sizes, args.repeat)
+    elif args.benchmark == "extract":
+        results = benchmark_extract(args.provinces, args.indicators, args.years, args.files,
+                                    extra_columns=args.extra_columns,
+                                    latency=args.latency,
+                                    seed=args.seed)
+    elif args.benchmark == "batch":
+        results = benchmark_batch(args.tenants, args.provinces, args.indicators, args.years, args.files,
+                                  latency=args.latency,
+                                  read_quota=args.read_quota,
+                                  max_pipelines=args.max_pipelines,
+                                  seed=args.seed,
+                                  verbose=args.verbose)
+    elif args.benchmark == "watch":
+        results = benchmark_watch(args.provinces, args.indicators, args.years, args.files,
+                                  edits=args.edits,
+                                  changed_cells=args.changed_cells,
+                                  poll_seconds=args.poll_seconds,
+                                  debounce_seconds=args.debounce_seconds,
+                                  push=args.push,
+                                  seed=args.seed,
+                                  verbose=args.verbose)
+    else:
+        results = benchmark_pipeline(args.provinces, args.indicators, args.years, args.files,
+                                     runs=args.runs,
+                                     latency=args.latency,
+                                     quota_error_rate=args.quota_error_rate,
+                                     read_quota=args.read_quota,
+                                     backoff_base=args.backoff_base,
+                                     max_workers=args.max_workers,
+                                     engine=args.engine,
+                                     changed_cells=args.changed_cells,
+                                     seed=args.seed,
+                                     verbose=args.verbose)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
@@ -0,0 +1,444 @@
+import csv, io, itertools, json, random, re, threading, time
+from collections import Counter
+from datetime import datetime, timezone
+import gspread, httplib2, requests
+from googleapiclient.errors import HttpError
+
+SPREADSHEET_MIME_TYPE = "application/vnd.google-apps.spreadsheet"
+
+def quota_api_error() -> gspread.exceptions.APIError:
+    response = requests.Response()
+    response.status_code = 429
+    response._content = json.dumps({"error": {"code": 429,
+                                              "message": "Quota exceeded (simulated)",
+                                              "status": "RESOURCE_EXHAUSTED"}}).encode()
+    return gspread.exceptions.APIError(response)
+
+def bad_request_api_error(message:str) -> gspread.exceptions.APIError:
+    response = requests.Response()
+    response.status_code = 400
+    response._content = json.dumps({"error": {"code": 400, "message": message, "status": "INVALID_ARGUMENT"}}).encode()
+    return gspread.exceptions.APIError(response)
+
+def quota_http_error() -> HttpError:
+    return HttpError(httplib2.Response({"status": 429}),
+                     json.dumps({"error": {"code": 429, "message": "Quota exceeded (simulated)"}}).encode())
+
+def to_api_value(cell_data:dict):
+    # CellData as written by batchUpdate -> the JSON value values.get hands back
+    value = cell_data.get("userEnteredValue")
+    if not value:
+        return ""
+    kind, content = next(iter(value.items()))
+    if kind == "numberValue" and float(content).is_integer():
+        return int(content)
+    return content
+
+def trim_values(grid:list[list]) -> list[list]:
+    # The values API leaves out trailing empty cells and rows
+    rows = list()
+    for row in grid:
+        end = len(row)
+        while end and row[end - 1] == "":
+            end -= 1
+        rows.append(row[:end])
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+class FakeWorksheetData:
+    def __init__(self, sheet_id:int, title:str, index:int, values:list[list], row_count:int=None, col_count:int=None):
+        self.id = sheet_id
+        self.title = title
+        self.index = index
+        self.row_count = max(row_count or 0, len(values), 1)
+        self.col_count = max(col_count or 0, max(map(len, values), default=0), 1)
+        self.cells:dict[tuple[int, int], object] = {(row, col): value
+                                                    for row, values_row in enumerate(values)
+                                                    for col, value in enumerate(values_row) if value != ""}
+
+    def grid(self) -> list[list]:
+        if not self.cells:
+            return []
+        num_rows = max(row for row, _ in self.cells) + 1
+        num_cols = max(col for _, col in self.cells) + 1
+        return trim_values([[self.cells.get((row, col), "") for col in range(num_cols)] for row in range(num_rows)])
+
+class FakeSpreadsheetData:
+    def __init__(self, sps_id:str, title:str):
+        self.id = sps_id
+        self.title = title
+        self.sheets:list[FakeWorksheetData] = list()
+
+class FakeGoogleBackend:
+    """In-memory Drive folder and Sheets spreadsheets behind fakes of the gspread and Drive clients.
+
+    Every API call is counted, can be slowed down by a fixed latency and fails with a simulated
+    429 quota error at quota_error_rate.
+    """
+    def __init__(self, latency:float=0.0, quota_error_rate:float=0.0, page_size:int=100, seed:int=0, on_transfer=None):
+        self.latency = latency
+        # Called as on_transfer(api, bytes_sent, bytes_received) with the JSON size of every successful call
+        self.on_transfer = on_transfer
+        self.quota_error_rate = quota_error_rate
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.calls:Counter = Counter()
+        self.quota_errors = 0
+        self.spreadsheets:dict[str, FakeSpreadsheetData] = dict()
+        self.files:dict[str, dict] = dict()
+        self.sheet_ids = itertools.count(1)
+        # Drive changes feed: a page token is a position in this log
+        self.changes:list[dict] = list()
+        self.channels:dict[str, dict] = dict()
+
+    def api_call(self, method:str, drive:bool=False):
+        with self.lock:
+            self.calls[method] += 1
+            fail = self.random.random() < self.quota_error_rate
+            if fail:
+                self.quota_errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise quota_http_error() if drive else quota_api_error()
+
+    def transferred(self, api:str, sent, received):
+        if self.on_transfer is not None:
+            self.on_transfer(api,
+                             len(json.dumps(sent).encode()) if sent is not None else 0,
+                             len(json.dumps(received).encode()) if received is not None else 0)
+        return received
+
+    def add_spreadsheet(self, sps_id:str, title:str, worksheets:dict[str, list[list]], parent:str=None,
+                        row_count:int=None, col_count:int=None) -> FakeSpreadsheetData:
+        spreadsheet = FakeSpreadsheetData(sps_id, title)
+        for index, (worksheet_title, values) in enumerate(worksheets.items()):
+            spreadsheet.sheets.append(FakeWorksheetData(next(self.sheet_ids), worksheet_title, index, values, row_count, col_count))
+        with self.lock:
+            self.spreadsheets[sps_id] = spreadsheet
+            self.files[sps_id] = {"id": sps_id, "name": title, "mimeType": SPREADSHEET_MIME_TYPE,
+                                  "parents": [parent] if parent else [], "version": "1",
+                                  "modifiedTime": datetime.now(timezone.utc).isoformat()}
+        self.record_change(sps_id)
+        return spreadsheet
+
+    def touch(self, file_id:str):
+        # A content change bumps the Drive revision, like an edit in the Sheets UI
+        with self.lock:
+            file = self.files[file_id]
+            file["version"] = str(int(file["version"]) + 1)
+            file["modifiedTime"] = datetime.now(timezone.utc).isoformat()
+        self.record_change(file_id)
+
+    def remove_file(self, file_id:str):
+        with self.lock:
+            del self.files[file_id]
+            self.spreadsheets.pop(file_id, None)
+        self.record_change(file_id, removed=True)
+
+    def record_change(self, file_id:str, removed:bool=False):
+        with self.lock:
+            self.changes.append({"fileId": file_id, "removed": removed})
+            channels = list(self.channels.values())
+        # Push channels get a notification per change, as Drive sends them (without the change itself)
+        for channel in channels:
+            try:
+                requests.post(channel["address"], timeout=5,
+                              headers={"X-Goog-Channel-ID": channel["id"],
+                                       "X-Goog-Channel-Token": channel.get("token", ""),
+                                       "X-Goog-Resource-State": "change"})
+            except requests.RequestException:
+                pass
+
+    def sheets_client(self, creds=None) -> "FakeSheetsClient":
+        return FakeSheetsClient(self)
+
+    def drive_service(self, creds=None) -> "FakeDriveService":
+        return FakeDriveService(self)
+
+    def spreadsheet_data(self, sps_id:str) -> FakeSpreadsheetData:
+        if sps_id not in self.spreadsheets:
+            raise gspread.exceptions.SpreadsheetNotFound(bad_request_api_error(f"Spreadsheet {sps_id} not found").response)
+        return self.spreadsheets[sps_id]
+
+class FakeHTTPClient:
+    def __init__(self, backend:FakeGoogleBackend):
+        self.backend = backend
+
+    def values_batch_get(self, id:str, ranges:list[str], params:dict=None) -> dict:
+        self.backend.api_call("values_batch_get")
+        spreadsheet = FakeSpreadsheet(self.backend, id, fetch=False)
+        return self.backend.transferred("sheets", None, {
+            "spreadsheetId": id,
+            "valueRanges": [{"range": value_range, "values": spreadsheet.range_values(value_range)}
+                            for value_range in ranges]})
+
+    def values_get(self, id:str, range:str, params:dict=None) -> dict:
+        self.backend.api_call("values_get")
+        spreadsheet = FakeSpreadsheet(self.backend, id, fetch=False)
+        return self.backend.transferred("sheets", None, {"range": range, "values": spreadsheet.range_values(range)})
+
+    def fetch_sheet_metadata(self, id:str, params:dict=None) -> dict:
+        self.backend.api_call("fetch_sheet_metadata")
+        with self.backend.lock:
+            return {"spreadsheetId": id,
+                    "sheets": [{"properties": {"sheetId": sheet.id, "title": sheet.title, "index": sheet.index}}
+                               for sheet in self.backend.spreadsheet_data(id).sheets]}
+
+class FakeRaw(io.BytesIO):
+    # Stands in for urllib3's response body, tell() is the number of bytes read so far
+    decode_content = False
+
+class FakeSession:
+    """The authenticated session, only the CSV export endpoint is served."""
+    def __init__(self, backend:FakeGoogleBackend):
+        self.backend = backend
+
+    def get(self, url:str, params:dict=None, stream:bool=False, **kwargs) -> requests.Response:
+        try:
+            self.backend.api_call("csv_export")
+        except gspread.exceptions.APIError as error:
+            return error.response
+        sps_id = re.search(r"/spreadsheets/d/([^/]+)/export", url).group(1)
+        with self.backend.lock:
+            sheet = next(sheet for sheet in self.backend.spreadsheet_data(sps_id).sheets if sheet.id == int(params["gid"]))
+            grid = sheet.grid()
+        # Cells as displayed: numbers in their shortest form, every row as wide as the widest
+        width = max(map(len, grid), default=0)
+        text = io.StringIO()
+        csv.writer(text, lineterminator="\n").writerows(row + [""] * (width - len(row)) for row in grid)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.raw = FakeRaw(text.getvalue().encode())
+        return response
+
+class FakeSheetsClient:
+    def __init__(self, backend:FakeGoogleBackend):
+        self.backend = backend
+        self.http_client = FakeHTTPClient(backend)
+        self.http_client.session = FakeSession(backend)
+
+    def open_by_key(self, key:str) -> "FakeSpreadsheet":
+        return FakeSpreadsheet(self.backend, key)
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet:"FakeSpreadsheet", data:FakeWorksheetData):
+        self.spreadsheet = spreadsheet
+        self.id = data.id
+        self.title = data.title
+        self.index = data.index
+        self.row_count = data.row_count
+        self.col_count = data.col_count
+
+class FakeSpreadsheet:
+    def __init__(self, backend:FakeGoogleBackend, sps_id:str, fetch:bool=True):
+        if fetch:
+            backend.api_call("fetch_sheet_metadata")
+        self.backend = backend
+        self.data = backend.spreadsheet_data(sps_id)
+        self.id = sps_id
+        self.title = self.data.title
+
+    def sheet_by_title(self, title:str) -> FakeWorksheetData:
+        for sheet in self.data.sheets:
+            if sheet.title == title:
+                return sheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def range_values(self, value_range:str) -> list[list]:
+        title = re.fullmatch(r"'((?:[^']|'')*)'(?:!.*)?|([^!]*)(?:!.*)?", value_range)
+        title = title.group(1).replace("''", "'") if title.group(1) is not None else title.group(2)
+        with self.backend.lock:
+            return self.sheet_by_title(title).grid()
+
+    def worksheet(self, title:str) -> FakeWorksheet:
+        self.backend.api_call("fetch_sheet_metadata")
+        with self.backend.lock:
+            return FakeWorksheet(self, self.sheet_by_title(title))
+
+    def worksheets(self) -> list[FakeWorksheet]:
+        self.backend.api_call("fetch_sheet_metadata")
+        with self.backend.lock:
+            return [FakeWorksheet(self, sheet) for sheet in self.data.sheets]
+
+    def values_get(self, range:str, params:dict=None) -> dict:
+        self.backend.api_call("values_get")
+        return self.backend.transferred("sheets", None, {"range": range, "values": self.range_values(range)})
+
+    def add_worksheet(self, title:str, rows:int, cols:int, index:int=None) -> FakeWorksheet:
+        self.backend.api_call("batch_update")
+        with self.backend.lock:
+            if any(sheet.title == title for sheet in self.data.sheets):
+                raise bad_request_api_error(f"A sheet with the name \"{title}\" already exists.")
+            sheet = FakeWorksheetData(next(self.backend.sheet_ids), title, len(self.data.sheets), [], rows, cols)
+            self.data.sheets.append(sheet)
+            return FakeWorksheet(self, sheet)
+
+    def del_worksheet(self, worksheet:FakeWorksheet):
+        self.batch_update({"requests": [{"deleteSheet": {"sheetId": worksheet.id}}]})
+
+    def batch_update(self, body:dict) -> dict:
+        self.backend.api_call("batch_update")
+        with self.backend.lock:
+            sheets = {sheet.id: sheet for sheet in self.data.sheets}
+            # Validate everything first: a batchUpdate is applied entirely or not at all
+            for request in body["requests"]:
+                for kind in ("updateCells", "appendDimension", "updateSheetProperties", "deleteSheet"):
+                    if kind in request:
+                        target = request[kind]
+                        sheet_id = (target.get("range") or target.get("start") or target.get("properties") or target)["sheetId"]
+                        if sheet_id not in sheets:
+                            raise bad_request_api_error(f"No grid with id: {sheet_id}")
+            for request in body["requests"]:
+                if "updateCells" in request:
+                    self.update_cells(sheets, request["updateCells"])
+                elif "appendDimension" in request:
+                    append = request["appendDimension"]
+                    sheet = sheets[append["sheetId"]]
+                    if append["dimension"] == "ROWS":
+                        sheet.row_count += append["length"]
+                    else:
+                        sheet.col_count += append["length"]
+                elif "updateSheetProperties" in request:
+                    properties = request["updateSheetProperties"]["properties"]
+                    sheet = sheets[properties["sheetId"]]
+                    for field in request["updateSheetProperties"]["fields"].split(","):
+                        setattr(sheet, field, properties[field])
+                elif "deleteSheet" in request:
+                    self.data.sheets.remove(sheets.pop(request["deleteSheet"]["sheetId"]))
+            self.data.sheets.sort(key=lambda sheet: sheet.index)
+            self.backend.touch(self.id)
+        return self.backend.transferred("sheets", body, {"spreadsheetId": self.id, "replies": [{} for _ in body["requests"]]})
+
+    @staticmethod
+    def update_cells(sheets:dict[int, FakeWorksheetData], update:dict):
+        rows = update.get("rows", [])
+        if "range" in update:
+            grid_range = update["range"]
+            sheet = sheets[grid_range["sheetId"]]
+            start_row, start_col = grid_range.get("startRowIndex", 0), grid_range.get("startColumnIndex", 0)
+            end_row = grid_range.get("endRowIndex", sheet.row_count)
+            end_col = grid_range.get("endColumnIndex", sheet.col_count)
+        else:
+            start = update["start"]
+            sheet = sheets[start["sheetId"]]
+            start_row, start_col = start.get("rowIndex", 0), start.get("columnIndex", 0)
+            end_row = start_row + len(rows)
+            end_col = start_col + max((len(row.get("values", [])) for row in rows), default=0)
+        if end_row > sheet.row_count or end_col > sheet.col_count:
+            raise bad_request_api_error(f"Range exceeds grid limits. Max rows: {sheet.row_count}, max columns: {sheet.col_count}")
+        for row_index in range(start_row, end_row):
+            offset = row_index - start_row
+            values = rows[offset].get("values", []) if offset < len(rows) else []
+            for col_index in range(start_col, end_col):
+                position = col_index - start_col
+                if "range" not in update and position >= len(values):
+                    continue
+                value = to_api_value(values[position]) if position < len(values) else ""
+                if value == "":
+                    sheet.cells.pop((row_index, col_index), None)
+                else:
+                    sheet.cells[(row_index, col_index)] = value
+
+class FakeRequest:
+    def __init__(self, backend:FakeGoogleBackend, method:str, result):
+        self.backend = backend
+        self.method = method
+        # Same attribute as googleapiclient's HttpRequest, the API method name
+        self.methodId = method
+        self.result = result
+
+    def execute(self):
+        self.backend.api_call(self.method, drive=True)
+        return self.backend.transferred("drive", None, self.result())
+
+class FakeFilesResource:
+    def __init__(self, backend:FakeGoogleBackend):
+        self.backend = backend
+
+    def list(self, q:str="", fields:str=None, pageSize:int=100, pageToken:str=None, **kwargs) -> FakeRequest:
+        def result():
+            parent = re.search(r"'([^']+)' in parents", q)
+            with self.backend.lock:
+                files = [dict(file) for file in self.backend.files.values()
+                         if parent is None or parent.group(1) in file["parents"]]
+            start = int(pageToken or 0)
+            page_size = min(pageSize, self.backend.page_size)
+            response = {"files": files[start:start + page_size]}
+            if start + page_size < len(files):
+                response["nextPageToken"] = str(start + page_size)
+            return response
+        return FakeRequest(self.backend, "drive.files.list", result)
+
+    def get(self, fileId:str, fields:str=None, **kwargs) -> FakeRequest:
+        def result():
+            with self.backend.lock:
+                return dict(self.backend.files[fileId])
+        return FakeRequest(self.backend, "drive.files.get", result)
+
+class FakeChangesResource:
+    def __init__(self, backend:FakeGoogleBackend):
+        self.backend = backend
+
+    def getStartPageToken(self, **kwargs) -> FakeRequest:
+        def result():
+            with self.backend.lock:
+                return {"startPageToken": str(len(self.backend.changes))}
+        return FakeRequest(self.backend, "drive.changes.getStartPageToken", result)
+
+    def list(self, pageToken:str, pageSize:int=100, includeRemoved:bool=True, fields:str=None, **kwargs) -> FakeRequest:
+        def result():
+            start = int(pageToken)
+            page_size = min(pageSize, self.backend.page_size)
+            with self.backend.lock:
+                log = self.backend.changes[start:start + page_size]
+                # Like Drive, a change carries the file as it is now, not as it was when the change happened
+                changes = [{"kind": "drive#change", "changeType": "file", "fileId": change["fileId"],
+                            "removed": change["removed"] or change["fileId"] not in self.backend.files,
+                            **({"file": dict(self.backend.files[change["fileId"]])} if change["fileId"] in self.backend.files else {})}
+                           for change in log if includeRemoved or change["fileId"] in self.backend.files]
+                end = start + len(log)
+                response = {"changes": changes}
+                if end < len(self.backend.changes):
+                    response["nextPageToken"] = str(end)
+                else:
+                    response["newStartPageToken"] = str(end)
+            return response
+        return FakeRequest(self.backend, "drive.changes.list", result)
+
+    def watch(self, pageToken:str, body:dict, **kwargs) -> FakeRequest:
+        def result():
+            channel = dict(body, resourceId=f"fake-resource-{body['id']}",
+                           expiration=str(body.get("expiration") or int((time.time() + 3600) * 1000)))
+            with self.backend.lock:
+                self.backend.channels[body["id"]] = channel
+            return {"kind": "api#channel", "id": channel["id"], "resourceId": channel["resourceId"],
+                    "expiration": channel["expiration"]}
+        return FakeRequest(self.backend, "drive.changes.watch", result)
+
+class FakeChannelsResource:
+    def __init__(self, backend:FakeGoogleBackend):
+        self.backend = backend
+
+    def stop(self, body:dict) -> FakeRequest:
+        def result():
+            with self.backend.lock:
+                self.backend.channels.pop(body["id"], None)
+            return {}
+        return FakeRequest(self.backend, "drive.channels.stop", result)
+
+class FakeDriveService:
+    def __init__(self, backend:FakeGoogleBackend):
+        self.backend = backend
+
+    def files(self) -> FakeFilesResource:
+        return FakeFilesResource(self.backend)
+
+    def changes(self) -> FakeChangesResource:
+        return FakeChangesResource(self.backend)
+
+    def channels(self) -> FakeChannelsResource:
+        return FakeChannelsResource(self.backend)
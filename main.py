@@ -1,31 +1,81 @@
-from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.oauth2 import service_account
 from google.oauth2.credentials import Credentials
-import io, json, gspread, gspread_dataframe, math, time, requests, os
+import argparse, contextvars, cProfile, hashlib, http.server, io, json, gspread, gspread_dataframe, math, numbers, random, re, sqlite3, sys, threading, time, tracemalloc, requests, os
+from abc import ABC, abstractmethod
+from contextlib import closing
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 import pandas as pd
+from pandas.io.parsers import TextParser
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 from googleapiclient.discovery import Resource
+from googleapiclient.http import build_http
+from google_auth_httplib2 import AuthorizedHttp
 import numpy as np
 from google_auth_oauthlib.flow import InstalledAppFlow
 import settings
-# from oauth2client.service_account import ServiceAccountCredentials
-# def get_creds(service_account_file: str, scope:list[str]) -> Credentials:
-#     try:
-#         creds = ServiceAccountCredentials.from_json_keyfile_name(service_account_file, scope)
-#     except FileNotFoundError:
-#         raise FileNotFoundError(f"Service account file '{service_account_file}' not found.")
-#     except json.JSONDecodeError:
-#         raise ValueError(f"Invalid JSON format in service account file '{service_account_file}'.")
-#     except Exception as e:
-#         raise Exception(f"An error occurred while loading service account credentials: {e}")
-    
-#     return creds
-def get_creds(credentials_file: str, token_file: str, scope:list[str]) -> Credentials:
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory then comes from tracemalloc only (--profile)
+    resource = None
+
+# The PipelineConfig a batch is running in this context (see run_batch), None for a single run
+CURRENT_PIPELINE:contextvars.ContextVar = contextvars.ContextVar("current_pipeline", default=None)
+
+class PipelineSettings:
+    """The settings module as the running pipeline sees it: the overrides of its PipelineConfig come first."""
+    def __init__(self, module):
+        object.__setattr__(self, "module", module)
+
+    def __getattr__(self, name:str):
+        config = CURRENT_PIPELINE.get()
+        if config is not None and name in config.settings:
+            return config.settings[name]
+        return getattr(self.module, name)
+
+    def __setattr__(self, name:str, value):
+        setattr(self.module, name, value)
+
+    def __delattr__(self, name:str):
+        delattr(self.module, name)
+
+settings = PipelineSettings(settings)
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """Runs every task in a copy of the submitting thread's context, so worker threads see the pipeline it runs."""
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def get_creds(credentials_file:str,
+              token_file:str,
+              scope:list[str],
+              service_account_file:str=None) -> Credentials | service_account.Credentials:
+    # A service account never needs a browser. A user token is refreshed silently as long as it has a
+    # refresh token; the browser consent flow is the last resort and is never started without a terminal.
+    if service_account_file:
+        return service_account.Credentials.from_service_account_file(service_account_file, scopes=scope)
     creds = None
     if os.path.exists(token_file):
         creds = Credentials.from_authorized_user_file(token_file, scope)
+    if creds and not creds.valid and creds.expired and creds.refresh_token:
+        try:
+            creds.refresh(Request())
+        except RefreshError as e:
+            print(f"Token refresh failed, a new login is needed: {e}")
+            creds = None
+        else:
+            with open(token_file, "w") as token:
+                token.write(creds.to_json())
     if not creds or not creds.valid:
+        if not sys.stdin.isatty():
+            raise Exception(f"No valid token in {token_file} and no terminal for the browser login: "
+                            "run once interactively or set SERVICE_ACCOUNT_FILE")
         flow = InstalledAppFlow.from_client_secrets_file(
             credentials_file, scope)
         creds = flow.run_local_server(port=0)
@@ -42,61 +92,432 @@ def get_creds(credentials_file: str, token_file: str, scope:list[str]) -> Creden
 #   cleaned_data_dict:dict = json.loads(download_file_from_google_drive(settings.METADATA_CLEANED_DATA))
 #   return cleaned_data_dict
 
+class RateLimiter:
+    """Thread-safe token bucket shared by every worker hitting the same API quota."""
+    def __init__(self, requests_per_minute:float, burst:int=1):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens:int=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+class RunMetrics:
+    """Thread-safe collector for one run: stage timings, API calls, bytes transferred and retries."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.stages:dict[str, dict] = dict()
+            self.api_calls:dict[str, dict] = dict()
+            self.transfers:dict[str, dict] = dict()
+            self.retries:list[dict] = list()
+
+    def record_stage(self, name:str, wall_seconds:float, thread_cpu_seconds:float, process_cpu_seconds:float,
+                     peak_rss_bytes:int | None, status:str):
+        stage = {"status": status, "wall_seconds": wall_seconds, "thread_cpu_seconds": thread_cpu_seconds,
+                 "process_cpu_seconds": process_cpu_seconds, "peak_rss_bytes": peak_rss_bytes}
+        if tracemalloc.is_tracing():
+            stage["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        with self.lock:
+            self.stages[name] = stage
+
+    def record_api_call(self, operation:str, seconds:float, attempts:int, limiter_wait_seconds:float, failed:bool=False):
+        with self.lock:
+            call = self.api_calls.setdefault(operation, {"calls": 0, "attempts": 0, "failed": 0,
+                                                         "seconds": 0.0, "limiter_wait_seconds": 0.0})
+            call["calls"] += 1
+            call["attempts"] += attempts
+            call["failed"] += failed
+            call["seconds"] += seconds
+            call["limiter_wait_seconds"] += limiter_wait_seconds
+
+    def record_retry(self, operation:str, status:int, attempt:int, delay:float):
+        with self.lock:
+            self.retries.append({"operation": operation, "status": status, "attempt": attempt,
+                                 "delay_seconds": delay, "at": time.time() - self.started_at})
+
+    def record_transfer(self, api:str, bytes_sent:int, bytes_received:int):
+        with self.lock:
+            transfer = self.transfers.setdefault(api, {"requests": 0, "bytes_sent": 0, "bytes_received": 0})
+            transfer["requests"] += 1
+            transfer["bytes_sent"] += bytes_sent
+            transfer["bytes_received"] += bytes_received
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+                    "wall_seconds": time.time() - self.started_at,
+                    "max_rss_bytes": max_rss_bytes(),
+                    "stages": {name: dict(values) for name, values in self.stages.items()},
+                    "api_calls": {name: dict(values) for name, values in self.api_calls.items()},
+                    "transfers": {name: dict(values) for name, values in self.transfers.items()},
+                    "retries": [dict(retry) for retry in self.retries]}
+
+    def save(self, path:str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2)
+
+def max_rss_bytes() -> int | None:
+    # Peak resident memory of the whole process so far
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+def current_rss_bytes() -> int | None:
+    # Resident memory of the process right now, only readable on Linux
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class RssSampler:
+    """Highest resident memory of the process while a block runs, sampled from a background thread.
+
+    Stages running at the same time share the process, so each one's peak includes the others' memory.
+    peak is None where the current resident memory cannot be read.
+    """
+    def __init__(self, interval:float=0.05):
+        self.interval = interval
+        self.peak:int | None = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample_until_stopped, daemon=True)
+
+    def sample(self):
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def sample_until_stopped(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> "RssSampler":
+        self.sample()
+        if self.peak is not None:
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.sample()
+
+class PipelineRunMetrics:
+    """RUN_METRICS as the running pipeline sees it: its PipelineConfig's collector in a batch, the process-wide one otherwise."""
+    def __init__(self, default:RunMetrics):
+        self.default = default
+
+    def __getattr__(self, name:str):
+        config = CURRENT_PIPELINE.get()
+        return getattr(self.default if config is None else config.metrics, name)
+
+RUN_METRICS = PipelineRunMetrics(RunMetrics())
+
+SHEETS_READ_LIMITER = RateLimiter(getattr(settings, "SHEETS_READ_REQUESTS_PER_MINUTE", 60),
+                                  getattr(settings, "SHEETS_READ_BURST", 5))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def get_error_status(error:Exception):
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.response.status_code
+    if isinstance(error, HttpError):
+        return error.resp.status
+    return None
+
+def call_with_backoff(func, *args, limiter:RateLimiter=None, max_retries:int=6, base_delay:float=None, max_delay:float=64.0, **kwargs):
+    # Exponential backoff with full jitter, only on quota (429) and server (5xx) errors
+    if base_delay is None:
+        base_delay = getattr(settings, "BACKOFF_BASE_SECONDS", 1.0)
+    # Drive requests are named by their API method (drive.files.list), everything else by the function
+    operation = getattr(getattr(func, "__self__", None), "methodId", None) or getattr(func, "__qualname__", repr(func))
+    started_at = time.perf_counter()
+    limiter_wait = 0.0
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            wait_started_at = time.perf_counter()
+            limiter.acquire()
+            limiter_wait += time.perf_counter() - wait_started_at
+        try:
+            result = func(*args, **kwargs)
+            RUN_METRICS.record_api_call(operation, time.perf_counter() - started_at, attempt + 1, limiter_wait)
+            return result
+        except (gspread.exceptions.APIError, HttpError) as e:
+            status = get_error_status(e)
+            if status not in RETRYABLE_STATUS_CODES or attempt == max_retries:
+                RUN_METRICS.record_api_call(operation, time.perf_counter() - started_at, attempt + 1, limiter_wait, failed=True)
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            RUN_METRICS.record_retry(operation, status, attempt + 1, delay)
+            print(f"Error: API returned {status} | Retrying in {delay:.1f} seconds . . .")
+            time.sleep(delay)
+
+# Every Google client is created through these two functions, the offline benchmark swaps them for fakes.
+# Clients are built once per set of credentials and reused for the whole process.
+CLIENTS_LOCK = threading.Lock()
+SHEETS_CLIENTS:dict[int, tuple[object, gspread.Client]] = dict()
+DRIVE_SERVICES = threading.local()
+DRIVE_DISCOVERY_DOCUMENT:dict = None
+
+def sheets_client(creds) -> gspread.Client:
+    # One keep-alive session with a connection pool for all threads; it refreshes the token by itself
+    with CLIENTS_LOCK:
+        cached = SHEETS_CLIENTS.get(id(creds))
+        if cached is not None and cached[0] is creds:
+            return cached[1]
+        session = AuthorizedSession(creds)
+        pool_size = getattr(settings, "HTTP_POOL_SIZE", 16)
+        session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        # Streamed responses (CSV exports) are counted by their reader, reading .content here would consume them
+        session.hooks["response"].append(
+            lambda response, *args, stream=False, **kwargs: None if stream else RUN_METRICS.record_transfer(
+                "sheets", len(response.request.body or b""), len(response.content)))
+        client = gspread.Client(creds, session=session)
+        SHEETS_CLIENTS[id(creds)] = (creds, client)
+        return client
+
+class MeteredHttp(AuthorizedHttp):
+    """AuthorizedHttp that reports every Drive request's payload sizes to RUN_METRICS."""
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        response, content = super().request(uri, method, body=body, headers=headers, **kwargs)
+        RUN_METRICS.record_transfer("drive", len(body or b""), len(content or b""))
+        return response, content
+
+def drive_service(creds) -> Resource:
+    # httplib2 connections are not thread-safe, so every thread keeps its own service and connection,
+    # all built from the bundled discovery document parsed once
+    global DRIVE_DISCOVERY_DOCUMENT
+    services = DRIVE_SERVICES.__dict__.setdefault("by_creds", dict())
+    cached = services.get(id(creds))
+    if cached is not None and cached[0] is creds:
+        return cached[1]
+    with CLIENTS_LOCK:
+        if DRIVE_DISCOVERY_DOCUMENT is None:
+            DRIVE_DISCOVERY_DOCUMENT = json.loads(get_static_doc("drive", "v3"))
+    service = build_from_document(DRIVE_DISCOVERY_DOCUMENT, http=MeteredHttp(creds, http=build_http()))
+    services[id(creds)] = (creds, service)
+    return service
+
+class SnapshotCache:
+    """Local Parquet copies of validated source sheets, keyed by Drive file id and revision.
+
+    The engine that read a sheet is part of its revision: gspread gives typed numbers and the CSV export
+    displayed text, so frames read by the other engine are not served after EXTRACT_ENGINE changes.
+    """
+    def __init__(self, directory:str, engine:str=None):
+        self.directory = directory
+        self.engine = engine
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.lock = threading.Lock()
+        self.manifest:dict = dict()
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+
+    def revision(self, file:dict) -> str:
+        return f"{self.engine}:{file.get('version')}@{file.get('modifiedTime')}"
+
+    def is_fresh(self, file:dict) -> bool:
+        entry = self.manifest.get(file['id'])
+        return (entry is not None
+                and entry["revision"] == self.revision(file)
+                and os.path.exists(os.path.join(self.directory, entry["path"])))
+
+    def get(self, file:dict) -> pd.DataFrame | None:
+        if not self.is_fresh(file):
+            return None
+        entry = self.manifest[file['id']]
+        path = os.path.join(self.directory, entry["path"])
+        if entry["format"] == "pickle":
+            return pd.read_pickle(path)
+        df = pd.read_parquet(path)
+        for column in df.columns[df.dtypes == object]:
+            # Arrow hands missing strings back as None, the sheet reader gives NaN
+            df[column] = df[column].where(df[column].notna(), np.nan)
+        return df
+
+    def put(self, file:dict, df:pd.DataFrame):
+        os.makedirs(self.directory, exist_ok=True)
+        # Parquet cannot hold object columns that mix numbers and text (e.g. "-" next to 1.5),
+        # and the conversion rules depend on that distinction, so such sheets are pickled instead
+        mixed = any(pd.api.types.infer_dtype(df[column], skipna=True) not in ("string", "empty")
+                    for column in df.columns if df[column].dtype == object)
+        file_format = "pickle" if mixed else "parquet"
+        path = f"{file['id']}.{'pkl' if mixed else 'parquet'}"
+        if mixed:
+            df.to_pickle(os.path.join(self.directory, path))
+        else:
+            # The index is kept: it holds the sheet row of every row (blank rows leave gaps), which
+            # validation reports
+            df.to_parquet(os.path.join(self.directory, path))
+        with self.lock:
+            previous = self.manifest.get(file['id'])
+            if previous is not None and previous["path"] != path and os.path.exists(os.path.join(self.directory, previous["path"])):
+                # Stale copy in the other format
+                os.remove(os.path.join(self.directory, previous["path"]))
+            self.manifest[file['id']] = {"name": file['name'],
+                                         "revision": self.revision(file),
+                                         "format": file_format,
+                                         "path": path}
+
+    def prune(self, file_ids:set[str]):
+        for file_id in set(self.manifest) - set(file_ids):
+            entry = self.manifest.pop(file_id)
+            path = os.path.join(self.directory, entry["path"])
+            if os.path.exists(path):
+                os.remove(path)
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+YEAR_COLUMN_PATTERN = re.compile(r"\d{4}")
+
+def get_year_columns(df:pd.DataFrame) -> list[str]:
+    # Every four-digit column header is a year, in ascending order
+    return sorted(column for column in df.columns if YEAR_COLUMN_PATTERN.fullmatch(str(column)))
+
+def is_cleaned_data_column(column:str) -> bool:
+    return column in ("Province", "Indicator ID") or YEAR_COLUMN_PATTERN.fullmatch(column) is not None
+
+def read_csv_export(client:gspread.Client, sps_id:str, gid:int) -> pd.DataFrame:
+    # The worksheet's CSV export is streamed through the shared session into a chunked parser, which keeps
+    # only the key and year columns and reads them as text. Values arrive as displayed in the sheet, so number
+    # formats must be ones the unit converters read (decimal comma, thousand dots), not currency or percent.
+    # Year cells that read as a plain number ("12.7", "1.5E+11") become numbers, as the values API returns
+    # them, except thousand-dot integers ("1.234"), which the Count converter reads as text.
+    response = client.http_client.session.get(f"https://docs.google.com/spreadsheets/d/{sps_id}/export",
+                                              params={"format": "csv", "gid": gid},
+                                              stream=True)
+    with closing(response):
+        if not response.ok:
+            raise gspread.exceptions.APIError(response)
+        response.raw.decode_content = True
+        chunks = list(pd.read_csv(response.raw,
+                                  usecols=is_cleaned_data_column,
+                                  dtype=str,
+                                  chunksize=getattr(settings, "CSV_CHUNK_ROWS", 50_000)))
+        RUN_METRICS.record_transfer("sheets", 0, response.raw.tell())
+    if not chunks:
+        return pd.DataFrame()
+    df = pd.concat(chunks, ignore_index=True).dropna(how="all")
+    for column in get_year_columns(df):
+        text = df[column].dropna()
+        is_number = text.str.fullmatch(NUMBER_PATTERN) & ~text.str.fullmatch(THOUSAND_DOT_PATTERN)
+        if is_number.any():
+            df[column] = df[column].astype(object)
+            numbers = text[is_number]
+            df.loc[numbers.index, column] = pd.Series([int(value) if value.lstrip("+-").isdigit() else float(value)
+                                                       for value in numbers], index=numbers.index, dtype=object)
+    return df
+
 def get_all_cleaned_data(creds, cleaned_data_folder_id:str):
     def list_files_in_folder(service:Resource, folder_id:str):
         
         try:
           query = f"'{folder_id}' in parents"
-          
-          results = (
-              service.files()
-              .list(q=query, fields="nextPageToken, files(id, name, mimeType)")
-              .execute()
-          )
-          items = results.get("files", [])
-          return items
+          items = list()
+          page_token = None
+          while True:
+              results = call_with_backoff(
+                  service.files()
+                  .list(q=query,
+                        fields="nextPageToken, files(id, name, mimeType, modifiedTime, version)",
+                        pageSize=1000,
+                        pageToken=page_token)
+                  .execute
+              )
+              items.extend(results.get("files", []))
+              page_token = results.get("nextPageToken")
+              if not page_token:
+                  return items
 
         except HttpError as error:
           print(f"An error occurred while listing files: {error}")
           return None
       
-    converted_column = [
-                        "Province",
-                        "Indicator ID",
-                        "2018", "2019", "2020", "2021", "2022", "2023"]
+    def read_cleaned_sheet(file:dict) -> pd.DataFrame:
+        sheet_name:str = file['name']
+        cached_df = snapshot_cache.get(file)
+        if cached_df is not None:
+            cached_df.attrs["sheet_name"] = sheet_name
+            return cached_df
+        try:
+            # One read request per sheet for gspread (the values of "main" by name), two for CSV (the sheet
+            # metadata for the gid of "main", then the export)
+            if engine == "csv":
+                metadata = call_with_backoff(sps_client.http_client.fetch_sheet_metadata, file['id'],
+                                             params={"fields": "sheets.properties(sheetId,title)"},
+                                             limiter=SHEETS_READ_LIMITER)
+                gid = next((sheet["properties"]["sheetId"] for sheet in metadata["sheets"]
+                            if sheet["properties"]["title"] == "main"), None)
+                if gid is None:
+                    raise gspread.exceptions.WorksheetNotFound("main")
+                df = call_with_backoff(read_csv_export, sps_client, file['id'], gid, limiter=SHEETS_READ_LIMITER)
+            else:
+                response = call_with_backoff(sps_client.http_client.values_get, file['id'], "'main'",
+                                             params={"valueRenderOption": "FORMULA",
+                                                     "dateTimeRenderOption": "FORMATTED_STRING"},
+                                             limiter=SHEETS_READ_LIMITER)
+                df = values_to_dataframe(response.get("values", []))
+        except Exception as e:
+            raise Exception(f"error while getting data from {sheet_name} : {e}")
+        
+        df.columns = list(map(lambda x: str(x), df.columns))
+        year_columns = get_year_columns(df)
+        if not year_columns or not {"Province", "Indicator ID"}.issubset(df.columns):
+            raise Exception(f"Invalid Column Structure from {sheet_name} with {list(df.columns)}")
+        df = df[["Province", "Indicator ID", *year_columns]]
+        # Kept with the frame so validation can point at the file a bad row came from
+        df.attrs["sheet_name"] = sheet_name
+        snapshot_cache.put(file, df)
+        return df
     
     try:
-        service = build("drive", "v3", credentials=creds)
+        service = drive_service(creds)
     except HttpError as error:
         print(f"An error occurred: {error}")
     
     file_items = list_files_in_folder(service, cleaned_data_folder_id)
-    df_list:list[pd.DataFrame] = list()
-    sps_client = gspread.authorize(creds)
-    for file in tqdm(file_items, desc="Processing Google Sheets files"):
-        if file['mimeType'] == "application/vnd.google-apps.spreadsheet" and file['name'].endswith("cleaned"):
-            sheet_id:str = file['id']
-            sheet_name:str = file['name']
-            
-            try:
-                spreadsheet = sps_client.open_by_key(sheet_id)
-                worksheet = spreadsheet.worksheet("main")
-                df = gspread_dataframe.get_as_dataframe(worksheet=worksheet)   
-            except gspread.exceptions.APIError as e:
-                print(f"Error: Quota Exceeded | Retrying in 65 seconds . . .")
-                time.sleep(65)
-                spreadsheet = sps_client.open_by_key(sheet_id)
-                worksheet = spreadsheet.worksheet("main")
-                df = gspread_dataframe.get_as_dataframe(worksheet=worksheet)
-            except Exception as e:
-                raise Exception(f"error while getting data from {sheet_name} : {e}")
-            
-            df.columns = list(map(lambda x: str(x), df.columns))
-            df = df[converted_column]
-            if list(df.columns) != converted_column:
-                raise Exception(f"Invalid Column Structure from {sheet_name} with {list(df.columns)}")
-            df_list.append(df)
-    print(f"\n{len(df_list)} DATAFRAME(S) COLLECTED FROM GOOGLE SHEETS")
+    cleaned_files = sorted([file for file in file_items
+                            if file['mimeType'] == "application/vnd.google-apps.spreadsheet" and file['name'].endswith("cleaned")],
+                           key=lambda file: (file['name'], file['id']))
+    engine = getattr(settings, "EXTRACT_ENGINE", "gspread")
+    if engine not in ("gspread", "csv"):
+        raise Exception(f"Invalid Extract Engine '{engine}'")
+    snapshot_cache = SnapshotCache(getattr(settings, "SNAPSHOT_CACHE_DIR", os.path.join(".cache", "snapshots")), engine)
+    cached_count = sum(snapshot_cache.is_fresh(file) for file in cleaned_files)
+    sps_client = sheets_client(creds)
+    max_workers = getattr(settings, "EXTRACT_MAX_WORKERS", 8)
+    with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map yields in submission order, so the result order does not depend on which read finishes first
+        df_list:list[pd.DataFrame] = list(tqdm(executor.map(read_cleaned_sheet, cleaned_files),
+                                               total=len(cleaned_files),
+                                               desc="Processing Google Sheets files"))
+    snapshot_cache.prune({file['id'] for file in cleaned_files})
+    snapshot_cache.save()
+    print(f"\n{len(df_list)} DATAFRAME(S) COLLECTED FROM GOOGLE SHEETS ({cached_count} FROM LOCAL SNAPSHOT)")
     return df_list
 
 
@@ -123,63 +544,107 @@ def get_all_cleaned_data(creds, cleaned_data_folder_id:str):
 
 def concatenate_cleaned_data(df_list:list[pd.DataFrame]) -> pd.DataFrame:
     concatenated_df = pd.concat(df_list, ignore_index=True)
+    # Files may cover different years, the union of their year columns is kept in ascending order
+    year_columns = get_year_columns(concatenated_df)
+    concatenated_df = concatenated_df[[column for column in concatenated_df.columns if column not in year_columns] + year_columns]
     
     print(f"CONCATENATED DATAFRAME SHAPE: {concatenated_df.shape}")
     print(f"{len(concatenated_df.Province.unique())} UNIQUE PROVINCE DETECTED")
     print(f"{len(concatenated_df['Indicator ID'].unique())} UNIQUE INDICATOR DETECTED")
-    print(f"{len(concatenated_df[~concatenated_df['2018'].isnull()])} NON-EMPTY VALUE DATA FROM 2018")
-    print(f"{len(concatenated_df[~concatenated_df['2019'].isnull()])} NON-EMPTY VALUE DATA FROM 2019")
-    print(f"{len(concatenated_df[~concatenated_df['2020'].isnull()])} NON-EMPTY VALUE DATA FROM 2020")
-    print(f"{len(concatenated_df[~concatenated_df['2021'].isnull()])} NON-EMPTY VALUE DATA FROM 2021")
-    print(f"{len(concatenated_df[~concatenated_df['2022'].isnull()])} NON-EMPTY VALUE DATA FROM 2022")
-    print(f"{len(concatenated_df[~concatenated_df['2023'].isnull()])} NON-EMPTY VALUE DATA FROM 2023")
+    for year, non_empty_count in concatenated_df[year_columns].notna().sum().items():
+        print(f"{non_empty_count} NON-EMPTY VALUE DATA FROM {year}")
     
     return concatenated_df
 
 def melt_cleaned_data(concatenated_df:pd.DataFrame) -> pd.DataFrame:
-    melted_df = pd.melt(concatenated_df, 
-                        id_vars=["Province", "Indicator ID"], 
-                        value_vars=["2018", "2019", "2020", "2021", "2022", "2023"],
-                        var_name="Year",
-                        value_name="Value")
-    melted_df = melted_df.sort_values(by=["Province", "Indicator ID", "Year"])
-    melted_df = melted_df.rename(columns={"Province":"Area",
-                                          "Indicator ID":"Indicator Code"})
+    # Same rows, order and index labels as pd.melt over the year columns followed by a stable sort on
+    # (Province, Indicator ID, Year), but only the rows are sorted: every row's years are already in order,
+    # so the long frame is one gather from the wide value block. Rows sharing a (Province, Indicator ID)
+    # key are interleaved year by year, as the sort would leave them.
+    year_columns = get_year_columns(concatenated_df)
+    keys = concatenated_df[["Province", "Indicator ID"]].reset_index(drop=True)
+    num_rows, num_years = len(keys), len(year_columns)
+    row_order = keys.sort_values(by=["Province", "Indicator ID"]).index.to_numpy()
+    province_codes = pd.factorize(keys.Province)[0][row_order]
+    indicator_codes = pd.factorize(keys["Indicator ID"])[0][row_order]
+    group_starts = np.flatnonzero(np.r_[True, (province_codes[1:] != province_codes[:-1]) | (indicator_codes[1:] != indicator_codes[:-1])]
+                                  if num_rows else [])
+    group_sizes = np.diff(np.r_[group_starts, num_rows])
+    group_of_row = np.repeat(np.arange(len(group_starts)), group_sizes)
+    start, size = group_starts[group_of_row], group_sizes[group_of_row]
+    rank = np.arange(num_rows) - start
+    target = (start * num_years + rank)[:, None] + np.arange(num_years)[None, :] * size[:, None]
+    source_row = np.empty(num_rows * num_years, dtype=np.intp)
+    source_year = np.empty(num_rows * num_years, dtype=np.intp)
+    source_row[target.ravel()] = np.repeat(row_order, num_years)
+    source_year[target.ravel()] = np.tile(np.arange(num_years), num_rows)
+    
+    melted_df = pd.DataFrame({"Area": keys.Province.to_numpy()[source_row],
+                              "Indicator Code": keys["Indicator ID"].to_numpy()[source_row],
+                              "Year": np.array(year_columns, dtype=object)[source_year],
+                              "Value": concatenated_df[year_columns].to_numpy()[source_row, source_year]},
+                             index=source_year * num_rows + source_row)
     
     print(f"MELTING DATA BY YEAR FROM {len(concatenated_df)} DATA to {len(melted_df)} DATA")
     print(f"MELTED DATAFRAME SHAPE: {melted_df.shape}")
     
     return melted_df
 
+def values_to_dataframe(values:list[list]) -> pd.DataFrame:
+    # Mirrors gspread_dataframe.get_as_dataframe on a raw value grid, without building a Cell per value
+    if not values:
+        return pd.DataFrame()
+    width = max(map(len, values))
+    rows = [row + [""] * (width - len(row)) for row in values]
+    df = TextParser(rows, header=0).read()
+    df = df.dropna(how="all", axis=0)
+    empty_unnamed_columns = [column for column in df.columns
+                             if isinstance(column, str) and column.startswith("Unnamed: ") and df[column].isna().all()]
+    return df.drop(columns=empty_unnamed_columns)
+
+def batch_get_values(client:gspread.Client, targets:list[tuple[str, str]]) -> list[list[list]]:
+    # One values.batchGet per distinct spreadsheet, all spreadsheets fetched in parallel
+    ranges_by_sps:dict[str, list[str]] = dict()
+    for sps_id, worksheet_name in targets:
+        ranges_by_sps.setdefault(sps_id, list())
+        if worksheet_name not in ranges_by_sps[sps_id]:
+            ranges_by_sps[sps_id].append(worksheet_name)
+
+    def fetch(sps_id:str) -> dict[str, list[list]]:
+        worksheet_names = ranges_by_sps[sps_id]
+        response = call_with_backoff(client.http_client.values_batch_get,
+                                     sps_id,
+                                     ["'" + name.replace("'", "''") + "'" for name in worksheet_names],
+                                     params={"valueRenderOption": "FORMULA",
+                                             "dateTimeRenderOption": "FORMATTED_STRING"},
+                                     limiter=SHEETS_READ_LIMITER)
+        return {name: value_range.get("values", [])
+                for name, value_range in zip(worksheet_names, response["valueRanges"])}
+
+    with ContextThreadPoolExecutor(max_workers=len(ranges_by_sps) or 1) as executor:
+        values_by_sps = dict(zip(ranges_by_sps, executor.map(fetch, ranges_by_sps)))
+    return [values_by_sps[sps_id][worksheet_name] for sps_id, worksheet_name in targets]
+
 def get_master_data(creds, master_worksheet:str): # (ID, GID)
   
-    client = gspread.authorize(creds)
+    client = sheets_client(creds)
     
-    master_area_client = client.open_by_key(settings.MASTER_AREA_SPSID)
-    master_area_worksheet = master_area_client.worksheet(master_worksheet)
-    try:
-        master_area_df = gspread_dataframe.get_as_dataframe(worksheet=master_area_worksheet, )
-    except HttpError:
-        print("Quota Exceeded | Wait a minute . . .")
-        master_area_df = gspread_dataframe.get_as_dataframe(worksheet=master_area_worksheet, )
+    master_area_values, master_inc_province_values, master_year_values, master_indicator_values = batch_get_values(
+        client,
+        [(settings.MASTER_AREA_SPSID, master_worksheet),
+         (settings.MASTER_INCOME_PROVINCE_SPSID, master_worksheet),
+         (settings.MASTER_YEAR_SPSID, master_worksheet),
+         (settings.MASTER_INDICATOR_SPSID, master_worksheet)])
+    
+    master_area_df = values_to_dataframe(master_area_values)
     master_area_df["ID"] = master_area_df["ID"].astype("int64").astype(str).apply(lambda x : x.zfill(2))
     
-    master_inc_province_client = client.open_by_key(settings.MASTER_INCOME_PROVINCE_SPSID)
-    master_inc_province_worksheet = master_inc_province_client.worksheet(master_worksheet)
-    try:
-        master_inc_province_df = gspread_dataframe.get_as_dataframe(worksheet=master_inc_province_worksheet)
-    except HttpError:
-        print("Quota Exceeded | Wait a minute . . .")
-        master_inc_province_df = gspread_dataframe.get_as_dataframe(worksheet=master_inc_province_worksheet)
-        
-    master_year_client = client.open_by_key(settings.MASTER_YEAR_SPSID)
-    master_year_worksheet = master_year_client.worksheet(master_worksheet)
-    master_year_df = gspread_dataframe.get_as_dataframe(worksheet=master_year_worksheet)
+    master_inc_province_df = values_to_dataframe(master_inc_province_values)
+    
+    master_year_df = values_to_dataframe(master_year_values)
     master_year_df.Year = master_year_df.Year.astype(int).astype(str)
     
-    master_indicator_client = client.open_by_key(settings.MASTER_INDICATOR_SPSID)
-    master_indicator_worksheet = master_indicator_client.worksheet(master_worksheet)
-    master_indicator_df = gspread_dataframe.get_as_dataframe(worksheet=master_indicator_worksheet, )
+    master_indicator_df = values_to_dataframe(master_indicator_values)
     
     print(f"ROWS OF AREA MASTER DATA : {len(master_area_df)}")
     print(f"ROWS OF PROVINCE INCOME MASTER DATA : {len(master_inc_province_df)}")
@@ -201,377 +666,1837 @@ def cross_merge_master(master_area:pd.DataFrame,
     print(f"FOUND {len(indicator)} INDICATOR DATA")
     print(f"FOUND {len(year)} YEAR DATA")
     
-    return province.merge(indicator, how='cross').merge(year, how='cross').rename(columns=column_to_rename)
+    # Same rows and order as a cross join of the three frames, but every column is categorical:
+    # the product holds one small integer code per cell, built from the key positions
+    num_province, num_indicator, num_year = len(province), len(indicator), len(year)
+    positions = [(province, np.repeat(np.arange(num_province), num_indicator * num_year)),
+                 (indicator, np.tile(np.repeat(np.arange(num_indicator), num_year), num_province)),
+                 (year.to_frame(), np.tile(np.arange(num_year), num_province * num_indicator))]
+    columns:dict[str, pd.Categorical] = dict()
+    for frame, position in positions:
+        for column in frame.columns:
+            codes, uniques = pd.factorize(frame[column])
+            columns[column] = pd.Categorical.from_codes(codes[position], uniques)
+    return pd.DataFrame(columns).rename(columns=column_to_rename)
+
+class ValidationError(Exception):
+    """Source values missing from the master data; report holds one row per offending cell."""
+    def __init__(self, report:pd.DataFrame):
+        self.report = report
+        summary = (report.groupby(["sheet", "column", "problem"], sort=False)["value"]
+                   .agg(rows="size", values=lambda values: values.astype(str).unique()[:5].tolist())
+                   .reset_index())
+        super().__init__(f"{len(report)} invalid value(s) found:\n{summary.to_string(index=False)}")
+
+VALIDATION_REPORT_COLUMNS = ["sheet", "row", "column", "value", "problem"]
 
-def validate_data_1(cross_merged_df:pd.DataFrame, melted_df:pd.DataFrame):
-    print("Ensuring cleaned data is a subset of master data . . .")
-    ensure_province:bool = set(melted_df.Area).issubset(cross_merged_df.Area) 
-    ensure_year:bool = set(melted_df.Year).issubset(cross_merged_df.Year) 
-    ensure_indicator:bool = set(melted_df["Indicator Code"]).issubset(cross_merged_df["Indicator Code"])
-    if not (ensure_province and ensure_indicator and ensure_year):
-        raise Exception("There('re/'s) Invalid Data from CLEANED DATA")
+def find_unknown_values(values:pd.Series, known:pd.Index, sheet:str, column:str, problem:str) -> pd.DataFrame:
+    # Report rows for the values missing from known, numbered as on the sheet (header on row 1)
+    unknown = ~values.isin(known).to_numpy()
+    return pd.DataFrame({"sheet": sheet,
+                         "row": values.index[unknown] + 2,
+                         "column": column,
+                         "value": values.to_numpy()[unknown],
+                         "problem": problem},
+                        columns=VALIDATION_REPORT_COLUMNS)
+
+def validate_cleaned_data(cleaned_data:list[pd.DataFrame], master_data:tuple[pd.DataFrame, ...]) -> pd.DataFrame:
+    # Provinces, indicator codes and year columns of every cleaned sheet are looked up in the master tables
+    # themselves (hash-based isin), so it does not need the cross product and can run alongside it
+    master_area_df, _, master_year_df, master_indicator_df = master_data
+    known_areas = pd.Index(master_area_df["AREA_NAME"].unique())
+    known_indicators = pd.Index(master_indicator_df["Indicator_Code"].unique())
+    known_years = pd.Index(master_year_df["Year"].astype(str).unique())
+    reports = list()
+    for position, df in enumerate(cleaned_data):
+        sheet = df.attrs.get("sheet_name", f"cleaned file {position + 1}")
+        reports.append(find_unknown_values(df["Province"], known_areas, sheet, "Province", "area not in master area"))
+        reports.append(find_unknown_values(df["Indicator ID"], known_indicators, sheet, "Indicator ID", "indicator not in master indicator"))
+        # A year column is wrong as a whole, it is reported once, on the header row
+        year_columns = pd.Index(get_year_columns(df))
+        unknown_years = year_columns[~year_columns.isin(known_years)]
+        reports.append(pd.DataFrame({"sheet": sheet, "row": 1, "column": unknown_years, "value": unknown_years,
+                                     "problem": "year not in master year"},
+                                    columns=VALIDATION_REPORT_COLUMNS))
+    return pd.concat(reports, ignore_index=True)
+
+def validate_master_data(master_data:tuple[pd.DataFrame, ...]) -> pd.DataFrame:
+    master_area_df, master_inc_province_df, _, _ = master_data
+    return find_unknown_values(master_inc_province_df["Provinsi"], pd.Index(master_area_df["AREA_NAME"].unique()),
+                               "master income province", "Provinsi", "province not in master area")
+
+def raise_for_report(report:pd.DataFrame):
+    if len(report) == 0:
+        return
+    report_path = getattr(settings, "VALIDATION_REPORT_PATH", "validation_report.csv")
+    report.to_csv(report_path, index=False)
+    print(f"FULL VALIDATION REPORT WRITTEN TO {report_path}")
+    raise ValidationError(report)
     
-def left_outer_merge_to_master(cross_merged_df:pd.DataFrame, melted_df:pd.DataFrame):
-    result = pd.merge(cross_merged_df,
-                      melted_df, 
-                      on=["Area", "Indicator Code", "Year"], how="left", )
+def uncategorize(df:pd.DataFrame) -> pd.DataFrame:
+    return df.astype({column: object for column, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)})
+
+def key_codes(values:pd.Series) -> tuple[np.ndarray, pd.Index]:
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    codes, uniques = pd.factorize(values)
+    return codes, pd.Index(uniques)
 
+def dense_join_positions(cross_merged_df:pd.DataFrame, melted_df:pd.DataFrame, keys:list[str]) -> np.ndarray | None:
+    # Row of melted_df matching every row of cross_merged_df (-1 for none), found through a dense integer key
+    # built from the category codes of the key columns. None when the keys are not unique on both sides,
+    # or missing, which only pd.merge handles (row multiplication, NaN matching NaN).
+    left_codes, categories = zip(*(key_codes(cross_merged_df[key]) for key in keys))
+    shape = tuple(map(len, categories))
+    if not all(pd.api.types.is_object_dtype(category.dtype) and pd.api.types.is_object_dtype(melted_df[key].dtype)
+               for key, category in zip(keys, categories)):
+        return None
+    if not all((codes >= 0).all() for codes in left_codes):
+        return None
+    right_codes = [category.get_indexer(melted_df[key]) for key, category in zip(keys, categories)]
+    matched = np.logical_and.reduce([codes >= 0 for codes in right_codes])
+    left_key = np.ravel_multi_index(left_codes, shape)
+    right_key = np.ravel_multi_index([codes[matched] for codes in right_codes], shape)
+    if (np.bincount(left_key, minlength=math.prod(shape)).max(initial=0) > 1
+        or np.bincount(right_key, minlength=math.prod(shape)).max(initial=0) > 1):
+        return None
+    melted_row = np.full(math.prod(shape), -1, dtype=np.intp)
+    melted_row[right_key] = np.flatnonzero(matched)
+    return melted_row[left_key]
+
+def left_outer_merge_to_master(cross_merged_df:pd.DataFrame, melted_df:pd.DataFrame):
+    # With a dense cross product the left merge is an array take instead of a hash join on three string columns
+    keys = ["Area", "Indicator Code", "Year"]
+    value_columns = [column for column in melted_df.columns if column not in keys]
+    positions = None
+    if not set(value_columns) & set(cross_merged_df.columns):
+        positions = dense_join_positions(cross_merged_df, melted_df, keys)
+    if positions is None:
+        return pd.merge(uncategorize(cross_merged_df), melted_df, on=keys, how="left")
+    
+    result = uncategorize(cross_merged_df)
+    result.index = pd.RangeIndex(len(result))
+    for column in value_columns:
+        result[column] = pd.api.extensions.take(melted_df[column].to_numpy(), positions, allow_fill=True)
     return result
 
+def convert_decimal_comma_values(values:pd.Series) -> pd.Series:
+    return values.astype(str).str.replace(",", ".", regex=False).astype(float)
+
+def convert_count_values(values:pd.Series) -> pd.Series:
+    # Numbers are truncated like int(value); text has its "." and "," separators stripped
+    is_text = values.apply(isinstance, args=(str,)).astype(bool)
+    converted = pd.Series(np.nan, index=values.index)
+    converted[~is_text] = np.trunc(values[~is_text].astype(float)) + 0.0
+    if is_text.any():
+        text = values[is_text]
+        converted[is_text] = text.str.replace(".", "", regex=False).str.replace(",", "", regex=False).astype(float)
+        # int("-0") gives 0, not -0.0
+        integer_text = text.str.fullmatch(r"\s*[+-]?\d+(?:_\d+)*\s*").astype(bool)
+        converted[integer_text[integer_text].index] += 0.0
+    return converted
+
+def convert_plain_values(values:pd.Series) -> pd.Series:
+    return values.astype(str).astype(float)
+
+VALUE_CONVERTERS = {
+    "%": convert_decimal_comma_values,
+    "Average": convert_decimal_comma_values,
+    "Count": convert_count_values,
+    "Rupiah": convert_plain_values,
+}
+
 def convert_value_dataframe(cleaned_data:pd.DataFrame):
-    def preprocess_value(unit, value):
-        if isinstance(value, float) and math.isnan(value) : return np.nan
-        if value == "-" : return np.nan
-        match unit:
-            case "%":
-                return str(value).replace(",", ".")
-            case "Average":
-                return str(value).replace(",", ".")
-            case "Count":
-                try:
-                    return int(value)
-                except ValueError:
-                    return str(value).replace(".", "").replace(",", "")
-            case "Rupiah":
-                return str(value).replace("", "")
-            case _:
-                raise Exception(f"Invalid Unit '{unit}'")
-    
-    
     converted_result = cleaned_data.copy(deep=True)
-    converted_result.Value = converted_result.apply(lambda row: preprocess_value(row.Unit, row.Value), axis=1).astype(float)
+    
+    values = converted_result.Value.reset_index(drop=True)
+    units = converted_result.Unit.reset_index(drop=True)
+    present = ~(values.isna() | values.eq("-"))
+    converted_value = pd.Series(np.nan, index=values.index)
+    for unit, unit_values in values[present].groupby(units[present], dropna=False, sort=False):
+        if unit not in VALUE_CONVERTERS:
+            raise Exception(f"Invalid Unit '{unit}'")
+        converted_value[unit_values.index] = VALUE_CONVERTERS[unit](unit_values)
+    converted_result.Value = converted_value.to_numpy()
     
     return converted_result 
 
-def write_data_to_sps(creds, sps_id:str, worksheet_name:str, df:pd.DataFrame):
-    client = gspread.authorize(creds)
+NUMBER_PATTERN = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+THOUSAND_DOT_PATTERN = re.compile(r"[+-]?[1-9]\d{0,2}(?:\.\d{3})+")
 
-    spreadsheet = client.open_by_key(sps_id)
-    worksheet = spreadsheet.worksheet(worksheet_name)
-    worksheet.clear()
-    
-    area_as_a_text_format = {
-        "numberFormat": {
-            "type": "TEXT"
-        }
-    }
-    num_rows = len(df) + 1
-    column_range = f'A2:A{num_rows}'
-    worksheet.format(column_range, area_as_a_text_format)
+def to_cell_value(value, as_text:bool=False) -> tuple[str, object] | None:
+    # How Sheets stores a DataFrame value written with USER_ENTERED, as (CellData value key, value)
+    if pd.isnull(value) is True:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return ("boolValue", bool(value))
+    if isinstance(value, numbers.Real):
+        return ("numberValue", float(value))
+    text = str(value)
+    if as_text or text == "":
+        return ("stringValue", text) if text else None
+    if text.startswith("="):
+        return ("formulaValue", text)
+    if NUMBER_PATTERN.fullmatch(text):
+        return ("numberValue", float(text))
+    if text.upper() in ("TRUE", "FALSE"):
+        return ("boolValue", text.upper() == "TRUE")
+    return ("stringValue", text)
+
+def read_cell_value(value) -> tuple[str, object] | None:
+    # Same representation for a value read back with valueRenderOption=FORMULA
+    if isinstance(value, bool):
+        return ("boolValue", value)
+    if isinstance(value, (int, float)):
+        return ("numberValue", float(value))
+    if value == "":
+        return None
+    if value.startswith("="):
+        return ("formulaValue", value)
+    return ("stringValue", value)
+
+def cell_to_api_value(cell:tuple[str, object] | None):
+    # Inverse of read_cell_value: the JSON value the values API returns for a stored cell
+    if cell is None:
+        return ""
+    kind, value = cell
+    if kind == "numberValue" and value.is_integer():
+        return int(value)
+    return value
+
+def to_cell_data(cell:tuple[str, object] | None) -> dict:
+    return {} if cell is None else {"userEnteredValue": {cell[0]: cell[1]}}
+
+def trim_row(row:list) -> tuple:
+    end = len(row)
+    while end and row[end - 1] is None:
+        end -= 1
+    return tuple(row[:end])
+
+def dataframe_to_cell_rows(df:pd.DataFrame) -> list[tuple]:
+    # Column A is formatted as TEXT, so its values are stored as typed
+    columns = [[to_cell_value(value, as_text=(position == 0)) for value in df.iloc[:, position].to_numpy(dtype=object)]
+               for position in range(len(df.columns))]
+    header = trim_row([to_cell_value(column, as_text=True) for column in df.columns])
+    return [header] + [trim_row(list(row)) for row in zip(*columns)]
+
+def plan_sheet_layout(current_rows:list[tuple], new_rows:list[tuple], key_positions:list[int]) -> list[tuple]:
+    # Rows whose business key is already on the sheet keep their position, new keys are appended and
+    # vanished keys dropped, so a small change stays a small diff even when the frame is ordered differently
+    if not key_positions or not current_rows or current_rows[0] != new_rows[0]:
+        return new_rows
+    row_key = lambda row: tuple(row[position] if position < len(row) else None for position in key_positions)
+    new_by_key = {row_key(row): row for row in new_rows[1:]}
+    if len(new_by_key) != len(new_rows) - 1:
+        return new_rows
+    layout = [new_rows[0]]
+    for row in current_rows[1:]:
+        key = row_key(row)
+        if key in new_by_key:
+            layout.append(new_by_key.pop(key))
+    layout.extend(new_by_key.values())
+    return layout
+
+def build_sheet_update_requests(sheet_id:int, row_count:int, col_count:int,
+                                current_rows:list[tuple], layout:list[tuple]) -> list[dict]:
+    requests = list()
+    num_cols = max(map(len, layout))
+    if len(layout) > row_count:
+        requests.append({"appendDimension": {"sheetId": sheet_id, "dimension": "ROWS", "length": len(layout) - row_count}})
+    if num_cols > col_count:
+        requests.append({"appendDimension": {"sheetId": sheet_id, "dimension": "COLUMNS", "length": num_cols - col_count}})
     
-    gspread_dataframe.set_with_dataframe(worksheet=worksheet, dataframe=df)
+    changed = [index for index, row in enumerate(layout)
+               if index >= len(current_rows) or current_rows[index] != row]
+    runs:list[list[int]] = list()
+    for index in changed:
+        if runs and runs[-1][-1] == index - 1:
+            runs[-1].append(index)
+        else:
+            runs.append([index])
+    for run in runs:
+        width = max(max(len(layout[index]) for index in run),
+                    max((len(current_rows[index]) for index in run if index < len(current_rows)), default=0))
+        if width == 0:
+            continue
+        # Cells inside the range that get no data are cleared, which drops leftovers from wider old rows
+        requests.append({"updateCells": {"range": {"sheetId": sheet_id,
+                                                   "startRowIndex": run[0], "endRowIndex": run[-1] + 1,
+                                                   "startColumnIndex": 0, "endColumnIndex": width},
+                                         "rows": [{"values": [to_cell_data(cell) for cell in layout[index]]} for index in run],
+                                         "fields": "userEnteredValue"}})
+    if len(current_rows) > len(layout):
+        requests.append({"updateCells": {"range": {"sheetId": sheet_id,
+                                                   "startRowIndex": len(layout), "endRowIndex": len(current_rows)},
+                                         "fields": "userEnteredValue"}})
+    return requests
+
+def sheet_format_requests(sheet_id:int, num_rows:int, num_cols:int) -> list[dict]:
+    grid_range = lambda start_row, end_row, end_col: {"sheetId": sheet_id,
+                                                      "startRowIndex": start_row, "endRowIndex": end_row,
+                                                      "startColumnIndex": 0, "endColumnIndex": end_col}
     border_style = {
         "style": "SOLID",
         "width": 1,
     }
+    return [
+        # Area code column stays text so leading zeros survive
+        {"repeatCell": {"range": grid_range(1, num_rows, 1),
+                        "cell": {"userEnteredFormat": {"numberFormat": {"type": "TEXT"}}},
+                        "fields": "userEnteredFormat(numberFormat)"}},
+        {"repeatCell": {"range": grid_range(0, num_rows, num_cols),
+                        "cell": {"userEnteredFormat": {"borders": {"top": border_style,
+                                                                   "bottom": border_style,
+                                                                   "left": border_style,
+                                                                   "right": border_style}}},
+                        "fields": "userEnteredFormat(borders)"}},
+        {"repeatCell": {"range": grid_range(0, 1, num_cols),
+                        "cell": {"userEnteredFormat": {"textFormat": {"bold": True}}},
+                        "fields": "userEnteredFormat(textFormat)"}},
+        {"autoResizeDimensions": {"dimensions": {"sheetId": sheet_id,
+                                                 "dimension": "COLUMNS",
+                                                 "startIndex": 0,
+                                                 "endIndex": num_cols}}},
+    ]
 
-    formatting = {
-        "borders": {
-          "top": border_style,
-          "bottom": border_style,
-          "left": border_style,
-          "right": border_style
-        }
-    }
-    num_rows = len(df) + 1
-    num_cols = len(df.columns)
-    range_to_border = f"A1:{gspread.utils.rowcol_to_a1(num_rows, num_cols)}"
-    worksheet.format(range_to_border, formatting)
-    
-    bold_format = {
-        "textFormat":{
-            "bold":True
-        }
-    }
-    range_to_bold = f"A1:{gspread.utils.rowcol_to_a1(1, len(df.columns))}"
-    worksheet.format(range_to_bold, bold_format)
-    
-    requests = [
-        {
-            "autoResizeDimensions": {
-                "dimensions": {
-                    "sheetId": worksheet.id, # The numeric ID of the worksheet
-                    "dimension": "COLUMNS",
-                    "startIndex": 0,
-                    "endIndex": len(df.columns)
-                }
-            }
-        }
+def frame_fingerprint(df:pd.DataFrame) -> str:
+    digest = hashlib.sha256(json.dumps(list(map(str, df.columns))).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+class LoadCheckpoint:
+    """Chunks of a staged load already committed, so an interrupted load resumes where it stopped.
+
+    The checkpoint only applies to a load of the same data; a different fingerprint starts over.
+    """
+    def __init__(self, directory:str, target:str, fingerprint:str):
+        self.path = os.path.join(directory, re.sub(r"[^\w.-]", "_", target) + ".json")
+        self.state = {"fingerprint": fingerprint, "committed_chunks": 0}
+        if os.path.exists(self.path):
+            with open(self.path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+            if state.get("fingerprint") == fingerprint:
+                self.state = state
+
+    @property
+    def committed_chunks(self) -> int:
+        return self.state["committed_chunks"]
+
+    def commit(self, committed_chunks:int, **details):
+        self.state.update(details, committed_chunks=committed_chunks)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as checkpoint_file:
+            json.dump(self.state, checkpoint_file)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def plan_chunks(rows:list[tuple], max_rows:int, max_bytes:int) -> list[tuple[int, int]]:
+    # (start, end) row ranges; a chunk closes at max_rows rows or once its estimated payload reaches max_bytes
+    chunks = list()
+    start, size = 0, 0
+    for index, row in enumerate(rows):
+        # ~40 bytes of JSON around every cell value
+        size += sum(40 + len(str(cell[1])) if cell is not None else 2 for cell in row)
+        if index + 1 - start >= max_rows or size >= max_bytes:
+            chunks.append((start, index + 1))
+            start, size = index + 1, 0
+    if start < len(rows):
+        chunks.append((start, len(rows)))
+    return chunks
+
+def load_sheet_via_staging(spreadsheet:gspread.Spreadsheet,
+                           worksheet:gspread.Worksheet,
+                           rows:list[tuple],
+                           checkpoint:LoadCheckpoint) -> None:
+    # Rows are streamed into a staging worksheet in size-bounded chunks, then the staging worksheet takes the
+    # live one's place in a single batchUpdate, so readers never see a half-loaded table. The spreadsheet briefly
+    # holds both copies, which counts against its cell limit.
+    staging_title = f"{worksheet.title}__staging"
+    num_cols = max(1, max(map(len, rows)))
+    worksheets = call_with_backoff(spreadsheet.worksheets, limiter=SHEETS_READ_LIMITER)
+    staging = next((sheet for sheet in worksheets if sheet.id == checkpoint.state.get("staging_sheet_id")), None)
+    if staging is None or checkpoint.committed_chunks == 0:
+        for sheet in worksheets:
+            if sheet.title == staging_title:
+                call_with_backoff(spreadsheet.del_worksheet, sheet)
+        staging = call_with_backoff(spreadsheet.add_worksheet, staging_title, rows=len(rows), cols=num_cols)
+        checkpoint.commit(0, staging_sheet_id=staging.id)
+    else:
+        print(f"RESUMING LOAD OF {worksheet.title} FROM CHUNK {checkpoint.committed_chunks + 1}")
+    
+    chunks = plan_chunks(rows,
+                         getattr(settings, "SHEETS_CHUNK_ROWS", 5000),
+                         getattr(settings, "SHEETS_CHUNK_BYTES", 2_000_000))
+    for chunk_index, (start, end) in enumerate(tqdm(chunks, desc=f"Loading {worksheet.title}")):
+        if chunk_index < checkpoint.committed_chunks:
+            continue
+        call_with_backoff(spreadsheet.batch_update, body={"requests": [
+            {"updateCells": {"start": {"sheetId": staging.id, "rowIndex": start, "columnIndex": 0},
+                             "rows": [{"values": [to_cell_data(cell) for cell in row]} for row in rows[start:end]],
+                             "fields": "userEnteredValue"}}]})
+        checkpoint.commit(chunk_index + 1)
+    
+    swap_requests = sheet_format_requests(staging.id, len(rows), num_cols) + [
+        {"updateSheetProperties": {"properties": {"sheetId": worksheet.id, "title": f"{worksheet.title}__old"},
+                                   "fields": "title"}},
+        {"updateSheetProperties": {"properties": {"sheetId": staging.id, "title": worksheet.title, "index": worksheet.index},
+                                   "fields": "title,index"}},
+        {"deleteSheet": {"sheetId": worksheet.id}},
     ]
+    call_with_backoff(spreadsheet.batch_update, body={"requests": swap_requests})
+    checkpoint.clear()
+    print(f"LOADED {len(rows)} ROWS INTO {worksheet.title} IN {len(chunks)} CHUNK(S)")
+
+def open_or_add_worksheet(spreadsheet:gspread.Spreadsheet, worksheet_name:str, num_cols:int) -> gspread.Worksheet:
+    # Tables added to the warehouse after it was set up (e.g. the rollup tables) get their worksheet on first write
+    try:
+        return call_with_backoff(spreadsheet.worksheet, worksheet_name, limiter=SHEETS_READ_LIMITER)
+    except gspread.exceptions.WorksheetNotFound:
+        print(f"ADDING WORKSHEET {worksheet_name}")
+        return call_with_backoff(spreadsheet.add_worksheet, worksheet_name, rows=1, cols=max(1, num_cols))
+
+def write_data_to_sps(creds, sps_id:str, worksheet_name:str, df:pd.DataFrame, key_columns:list[str]=None):
+    client = sheets_client(creds)
+
+    spreadsheet = call_with_backoff(client.open_by_key, sps_id, limiter=SHEETS_READ_LIMITER)
+    worksheet = open_or_add_worksheet(spreadsheet, worksheet_name, len(df.columns))
+    new_rows = dataframe_to_cell_rows(df)
+    checkpoint = LoadCheckpoint(getattr(settings, "LOAD_CHECKPOINT_DIR", os.path.join(".cache", "checkpoints")),
+                                f"{sps_id}_{worksheet_name}",
+                                frame_fingerprint(df))
+    if checkpoint.committed_chunks:
+        load_sheet_via_staging(spreadsheet, worksheet, new_rows, checkpoint)
+        return df
+    
+    current_values = call_with_backoff(spreadsheet.values_get,
+                                       "'" + worksheet.title.replace("'", "''") + "'",
+                                       params={"valueRenderOption": "FORMULA"},
+                                       limiter=SHEETS_READ_LIMITER).get("values", [])
+    
+    current_rows = [trim_row([read_cell_value(value) for value in row]) for row in current_values]
+    key_positions = [list(df.columns).index(column) for column in key_columns or []]
+    layout = plan_sheet_layout(current_rows, new_rows, key_positions)
+    requests = build_sheet_update_requests(worksheet.id, worksheet.row_count, worksheet.col_count, current_rows, layout)
+    if not requests:
+        print(f"NO CHANGES TO WRITE ON {worksheet_name}")
+        return df
+    
+    changed_rows = sum(request["updateCells"]["range"]["endRowIndex"] - request["updateCells"]["range"]["startRowIndex"]
+                       for request in requests if "updateCells" in request)
+    if changed_rows > getattr(settings, "SHEETS_CHUNK_ROWS", 5000):
+        # Too large for one request: reload the whole table through a staging worksheet
+        load_sheet_via_staging(spreadsheet, worksheet, new_rows, checkpoint)
+        return df
+    
+    requests.extend(sheet_format_requests(worksheet.id, len(df) + 1, len(df.columns)))
+    print(f"WRITING {changed_rows} CHANGED ROW(S) OF {len(df) + 1} TO {worksheet_name}")
+    # Values, grid growth, truncation and formatting all go out in one batchUpdate
+    call_with_backoff(spreadsheet.batch_update, body={'requests': requests})
+    
+    return df
 
-    # Send the batch update request to the spreadsheet
-    spreadsheet.batch_update(body={'requests': requests})
+def write_changed_rows_to_sps(creds, sps_id:str, worksheet_name:str, df:pd.DataFrame, changed:np.ndarray, key_columns:list[str]=None):
+    # The worksheet is taken to hold df except for the rows under changed, so those rows are written
+    # without reading the sheet back first
+    if not changed.any():
+        print(f"NO CHANGES TO WRITE ON {worksheet_name}")
+        return df
+    if changed.sum() > getattr(settings, "SHEETS_CHUNK_ROWS", 5000):
+        return write_data_to_sps(creds, sps_id, worksheet_name, df, key_columns=key_columns)
+    
+    client = sheets_client(creds)
+    spreadsheet = call_with_backoff(client.open_by_key, sps_id, limiter=SHEETS_READ_LIMITER)
+    worksheet = call_with_backoff(spreadsheet.worksheet, worksheet_name, limiter=SHEETS_READ_LIMITER)
+    layout = dataframe_to_cell_rows(df)
+    # Changed rows stand in as empty on the "current" side, so only they get an updateCells range
+    current_rows = [(None,) * len(df.columns)] * len(layout)
+    current_rows[0] = layout[0]
+    for position in np.flatnonzero(~changed):
+        current_rows[position + 1] = layout[position + 1]
+    requests = build_sheet_update_requests(worksheet.id, worksheet.row_count, worksheet.col_count, current_rows, layout)
+    requests.extend(sheet_format_requests(worksheet.id, len(df) + 1, len(df.columns)))
+    print(f"WRITING {changed.sum()} CHANGED ROW(S) OF {len(df) + 1} TO {worksheet_name}")
+    call_with_backoff(spreadsheet.batch_update, body={'requests': requests})
     
     return df
 
+MERGED_DATA_SCHEMA = {
+    "Area Code": str,
+    "Area": "object",
+    "Indicator Code": "object",
+    "Indicator Name": "object",
+    "Unit": "object",
+    "Year": "int64",
+    "Value": "float64",
+}
+
+def apply_merged_data_schema(df:pd.DataFrame) -> pd.DataFrame:
+    # Area codes keep their leading zero and years become integers, as they did after a round trip
+    # through the merged sheet, so the frame can be handed to handle_fact_value directly
+    typed_df = df.astype(MERGED_DATA_SCHEMA)
+    typed_df["Area Code"] = typed_df["Area Code"].str.zfill(2)
+    return typed_df
+
+def publish_merged_data(sink, table:str, df:pd.DataFrame) -> pd.DataFrame | None:
+    if not getattr(settings, "PUBLISH_MERGED_DATA", True):
+        print("Publishing merged data is disabled (PUBLISH_MERGED_DATA).")
+        return None
+    print(f"Publishing {len(df)} rows of merged data to {table} . . .")
+    return sink.write(table, df, key_columns=["Area Code", "Indicator Code", "Year"])
+
 def get_dataframe_from_sheet(creds, sps_id:str, worksheet_name:str):
-    client = gspread.authorize(creds)
+    client = sheets_client(creds)
 
-    spreadsheet = client.open_by_key(sps_id)
-    worksheet = spreadsheet.worksheet(worksheet_name)
-    df = gspread_dataframe.get_as_dataframe(worksheet=worksheet)
+    spreadsheet = call_with_backoff(client.open_by_key, sps_id, limiter=SHEETS_READ_LIMITER)
+    worksheet = call_with_backoff(spreadsheet.worksheet, worksheet_name, limiter=SHEETS_READ_LIMITER)
+    df = call_with_backoff(gspread_dataframe.get_as_dataframe, worksheet=worksheet, limiter=SHEETS_READ_LIMITER)
     
     return df
 
-def handle_dim_year(creds:Credentials,
-                    dim_year:pd.DataFrame,
-                    master_year_df:pd.DataFrame,
-                    default_null_value:str) -> pd.DataFrame:
-    dim_year[["year"]] = dim_year[["year"]].astype(int).astype(str)
-    
-    # Implementation of SCD TYPE 1
-    rename_source_year = master_year_df.fillna(default_null_value).rename(columns={"Year":"year", "Notes":"note"})
-    drop_duplicates_source_year = rename_source_year.drop_duplicates(subset=["year"], keep="last").set_index("year")
-    dim_year_buskey_as_index = dim_year.set_index("year")
-    dim_year_buskey_as_index.update(drop_duplicates_source_year)
-    
-    # ADD NEW DATA
-    new_year = drop_duplicates_source_year[~drop_duplicates_source_year.index.isin(dim_year_buskey_as_index.index)]
-    concatenated_dim_year = pd.concat([dim_year_buskey_as_index, new_year])
-    
-    # WRITE TO SPS
-    final_dim_year = concatenated_dim_year.reset_index()
-    final_dim_year.insert(0, 'id', range(1, len(final_dim_year)+1))
-    write_data_to_sps(creds, settings.WAREHOUSE_DATA_SPS_ID, "dim_year", final_dim_year)
-    return final_dim_year
-
-def handle_dim_location(creds:Credentials, 
-                        dim_location:pd.DataFrame,
-                        master_area_df:pd.DataFrame,
-                        master_inc_province_df:pd.DataFrame,
-                        default_null_value:str) -> pd.DataFrame:
-    
-    # HANDLE dim_location
-    if not set(master_inc_province_df["Provinsi"]).issubset(set(master_area_df["AREA_NAME"])):
-        raise Exception("Invalid Province Name Found")
-
-    dim_location["area_code"] = dim_location["area_code"].astype(int).astype(str).apply(lambda dt: dt.zfill(2))
-
-    # RENAMED MASTER
-    renamed_master_inc =  master_inc_province_df.rename(columns={"Provinsi":"area_name",
-                                                        "Tingkat_Pendapatan":"income_level_name",
-                                                        "ID_Pendapatan":"income_level_code"})
-    renamed_master_area = master_area_df.rename(columns={ "ID":"area_code",
-                                                "AREA_NAME":"area_name",
-                                                "AREA_TYPE":"area_type",
-                                                "REGION_GROUP":"region_name",
-                                                "ID_REGION":"region_code"
-                                                })
-
-    # MERGE AREA
-    merged_area =  renamed_master_area.merge(renamed_master_inc,on=["area_name"], how="left")[dim_location.columns]
-
-    # Implementation of SCD TYPE 1
-    rename_source_area = merged_area.fillna(default_null_value)
-    drop_duplicates_source_area = rename_source_area.drop_duplicates(subset=["area_code"], keep="last").set_index("area_code")
-    dim_location_buskey_as_index = dim_location.set_index("area_code")
-    dim_location_buskey_as_index.update(drop_duplicates_source_area)
-
-    # ADD NEW DATA
-    new_location = drop_duplicates_source_area[~drop_duplicates_source_area.index.isin(dim_location_buskey_as_index.index)]
-    concatenated_dim_location = pd.concat([dim_location_buskey_as_index, new_location])
-
-    # WRITE TO SPS
-    final_dim_location = concatenated_dim_location.reset_index()
-    final_dim_location.insert(0, 'id', range(1, len(final_dim_location)+1))
-    write_data_to_sps(creds, settings.WAREHOUSE_DATA_SPS_ID, "dim_location", final_dim_location)
-    
-    return final_dim_location
-
-def handle_dim_indicator(creds:Credentials, 
-                        dim_indicator:pd.DataFrame,
-                        master_indicator_df:pd.DataFrame,
-                        default_null_value:str) -> pd.DataFrame:
-    
-    # IMPLEMENTATION OF SCD TYPE 1
-    rename_source_indicator = master_indicator_df.fillna(default_null_value).rename(columns={
-                                                                                            "Indicator_Code":"indicator_code",
-                                                                                            "Indicator_Name":"indicator_name",
-                                                                                            "Category_ID":"category_id",
-                                                                                            "Category":"category_name",
-                                                                                            "Sub_Category_ID":"sub_category_id",
-                                                                                            "Sub_Category":"sub_category_name",
-                                                                                            "Area_ID":"area_type_id",
-                                                                                            "Area_Type":"area_type_name",
-                                                                                            "Unit":"unit"
-                                                                                            })[dim_indicator.columns]
-    drop_duplicates_source_indicator = rename_source_indicator.drop_duplicates(subset=["indicator_code"], keep="last").set_index("indicator_code")
-    dim_indicator_buskey_as_index = dim_indicator.set_index("indicator_code")
-    dim_indicator_buskey_as_index.update(drop_duplicates_source_indicator)
-
-
-    # ADD NEW DATA
-    new_indicator = drop_duplicates_source_indicator[~drop_duplicates_source_indicator.index.isin(dim_indicator_buskey_as_index.index)]
-    concatenated_dim_indicator = pd.concat([dim_indicator_buskey_as_index, new_indicator])
-
-    # WRITE TO SPS
-    final_dim_indicator = concatenated_dim_indicator.reset_index()
-    final_dim_indicator.insert(0, 'id', range(1, len(final_dim_indicator)+1))
-    write_data_to_sps(creds, settings.WAREHOUSE_DATA_SPS_ID, "dim_indicator", final_dim_indicator)
-    
-    return final_dim_indicator
-
-def handle_fact_value(creds:Credentials,
+ROLLUP_MEASURES = ["value_count", "mean_value", "min_value", "max_value",
+                   "grade_a_count", "grade_b_count", "grade_c_count", "grade_d_count"]
+
+WAREHOUSE_COLUMNS = {
+    "dim_year": ["id", "year", "note"],
+    "dim_location": ["id", "area_code", "area_name", "area_type", "region_name", "region_code",
+                     "income_level_name", "income_level_code"],
+    "dim_indicator": ["id", "indicator_code", "indicator_name", "category_id", "category_name",
+                      "sub_category_id", "sub_category_name", "area_type_id", "area_type_name", "unit"],
+    "fact_it_ecosystem": ["dim_year_id", "dim_indicator_id", "dim_location_id", "value", "relative_value"],
+    "rollup_region_category": ["region_code", "region_name", "category_id", "category_name", "year"] + ROLLUP_MEASURES,
+    "rollup_region_sub_category": ["region_code", "region_name", "category_id", "category_name",
+                                   "sub_category_id", "sub_category_name", "year"] + ROLLUP_MEASURES,
+    "rollup_national_category": ["category_id", "category_name", "year"] + ROLLUP_MEASURES,
+    "rollup_national_sub_category": ["category_id", "category_name", "sub_category_id", "sub_category_name", "year"] + ROLLUP_MEASURES,
+}
+
+class WarehouseSink(ABC):
+    """Storage the warehouse tables are read from and loaded into."""
+    @abstractmethod
+    def read(self, table:str) -> pd.DataFrame:
+        ...
+
+    @abstractmethod
+    def write(self, table:str, df:pd.DataFrame, key_columns:list[str]=None) -> pd.DataFrame:
+        ...
+
+    def write_changes(self, table:str, df:pd.DataFrame, changed:np.ndarray, key_columns:list[str]=None) -> pd.DataFrame:
+        # df is the whole table, as read() returned it except for the rows under changed (updated in place
+        # or appended); sinks that can, write only those rows
+        return self.write(table, df, key_columns=key_columns)
+
+    def revision(self) -> str | None:
+        # Changes whenever anything is written to the storage, by this pipeline or anyone else;
+        # None when it cannot tell
+        return None
+
+class GoogleSheetsSink(WarehouseSink):
+    """One worksheet per table in a Google spreadsheet."""
+    def __init__(self, creds, sps_id:str):
+        self.creds = creds
+        self.sps_id = sps_id
+
+    def read(self, table:str) -> pd.DataFrame:
+        return get_dataframe_from_sheet(self.creds, self.sps_id, table)
+
+    def write(self, table:str, df:pd.DataFrame, key_columns:list[str]=None) -> pd.DataFrame:
+        return write_data_to_sps(self.creds, self.sps_id, table, df, key_columns=key_columns)
+
+    def write_changes(self, table:str, df:pd.DataFrame, changed:np.ndarray, key_columns:list[str]=None) -> pd.DataFrame:
+        return write_changed_rows_to_sps(self.creds, self.sps_id, table, df, changed, key_columns=key_columns)
+
+    def revision(self) -> str | None:
+        # Drive bumps the version of a spreadsheet on every edit, through the API or by hand
+        file = call_with_backoff(drive_service(self.creds).files().get(fileId=self.sps_id, fields="version, modifiedTime").execute)
+        return f"{file.get('version')}@{file.get('modifiedTime')}"
+
+def quote_identifier(name:str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+def sqlite_column_type(dtype) -> str:
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+class SQLiteSink(WarehouseSink):
+    """One table per warehouse table in a local SQLite database, with no size cap."""
+    def __init__(self, path:str):
+        self.path = path
+
+    def connect(self) -> sqlite3.Connection:
+        # Transactions are opened explicitly so that DDL is covered by them too. They take the write lock
+        # up front (BEGIN IMMEDIATE) so concurrent table loads wait for each other instead of failing with
+        # "database is locked" when a read lock cannot be upgraded.
+        return sqlite3.connect(self.path, isolation_level=None, timeout=60)
+
+    def revision(self) -> str | None:
+        # Every committed write changes the database file
+        if not os.path.exists(self.path):
+            return None
+        stat = os.stat(self.path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def read(self, table:str) -> pd.DataFrame:
+        with closing(self.connect()) as connection:
+            exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+            if not exists:
+                return pd.DataFrame(columns=WAREHOUSE_COLUMNS.get(table, []))
+            return pd.read_sql_query(f"SELECT * FROM {quote_identifier(table)}", connection)
+
+    def write(self, table:str, df:pd.DataFrame, key_columns:list[str]=None) -> pd.DataFrame:
+        # Chunks go into a staging table, each committed together with its checkpoint row, and the staging
+        # table replaces the live one in a final transaction. A crashed load of the same data resumes from
+        # the last committed chunk and the live table is never half-loaded.
+        staging_table = f"{table}__staging"
+        fingerprint = frame_fingerprint(df)
+        chunk_rows = getattr(settings, "SQLITE_CHUNK_ROWS", 50_000)
+        column_definitions = ", ".join(f"{quote_identifier(column)} {sqlite_column_type(dtype)}"
+                                       for column, dtype in df.dtypes.items())
+        insert_statement = f"INSERT INTO {quote_identifier(staging_table)} VALUES ({', '.join('?' * len(df.columns))})"
+        with closing(self.connect()) as connection:
+            def transaction(*statements:tuple):
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    for statement, parameters in statements:
+                        if isinstance(parameters, list):
+                            connection.executemany(statement, parameters)
+                        else:
+                            connection.execute(statement, parameters)
+                    connection.execute("COMMIT")
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    raise
+
+            connection.execute("CREATE TABLE IF NOT EXISTS _load_checkpoints "
+                               "(target TEXT PRIMARY KEY, fingerprint TEXT, committed_chunks INTEGER)")
+            state = connection.execute("SELECT fingerprint, committed_chunks FROM _load_checkpoints WHERE target = ?",
+                                       (table,)).fetchone()
+            committed_chunks = state[1] if state is not None and state[0] == fingerprint else 0
+            if committed_chunks == 0:
+                transaction((f"DROP TABLE IF EXISTS {quote_identifier(staging_table)}", ()),
+                            (f"CREATE TABLE {quote_identifier(staging_table)} ({column_definitions})", ()),
+                            ("INSERT OR REPLACE INTO _load_checkpoints VALUES (?, ?, 0)", (table, fingerprint)))
+            else:
+                print(f"RESUMING LOAD OF {table} FROM CHUNK {committed_chunks + 1}")
+            
+            for chunk_index, start in enumerate(range(0, len(df), chunk_rows)):
+                if chunk_index < committed_chunks:
+                    continue
+                chunk = df.iloc[start:start + chunk_rows]
+                rows = list(chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None))
+                transaction((insert_statement, rows),
+                            ("UPDATE _load_checkpoints SET committed_chunks = ? WHERE target = ?", (chunk_index + 1, table)))
+            
+            transaction((f"DROP TABLE IF EXISTS {quote_identifier(table)}", ()),
+                        (f"ALTER TABLE {quote_identifier(staging_table)} RENAME TO {quote_identifier(table)}", ()),
+                        ("DELETE FROM _load_checkpoints WHERE target = ?", (table,)))
+        print(f"LOADED {len(df)} ROWS INTO {table} ({self.path})")
+        return df
+
+    def write_changes(self, table:str, df:pd.DataFrame, changed:np.ndarray, key_columns:list[str]=None) -> pd.DataFrame:
+        with closing(self.connect()) as connection:
+            stored_columns = [row[1] for row in connection.execute(f"PRAGMA table_info({quote_identifier(table)})")]
+            if not key_columns or stored_columns != list(df.columns):
+                return self.write(table, df, key_columns=key_columns)
+            if not changed.any():
+                print(f"NO CHANGES TO WRITE ON {table} ({self.path})")
+                return df
+            rows = df[changed]
+            key_condition = " AND ".join(f"{quote_identifier(column)} IS ?" for column in key_columns)
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(f"DELETE FROM {quote_identifier(table)} WHERE {key_condition}",
+                                       list(rows[key_columns].astype(object).where(rows[key_columns].notna(), None)
+                                            .itertuples(index=False, name=None)))
+                connection.executemany(f"INSERT INTO {quote_identifier(table)} VALUES ({', '.join('?' * len(df.columns))})",
+                                       list(rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None)))
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        print(f"WROTE {len(rows)} CHANGED ROW(S) OF {len(df)} TO {table} ({self.path})")
+        return df
+
+class InMemorySheetsSink(WarehouseSink):
+    """Offline stand-in for the warehouse spreadsheet.
+
+    Tables are kept as the typed cell grid a worksheet would hold after write_data_to_sps,
+    and read back through the same parser as get_dataframe_from_sheet.
+    """
+    def __init__(self):
+        self.grids:dict[str, list[tuple]] = dict()
+        self.writes = 0
+
+    def revision(self) -> str | None:
+        return f"{id(self)}:{self.writes}"
+
+    def read(self, table:str) -> pd.DataFrame:
+        rows = self.grids.get(table, [tuple(("stringValue", column) for column in WAREHOUSE_COLUMNS.get(table, []))])
+        return values_to_dataframe([[cell_to_api_value(cell) for cell in row] for row in rows])
+
+    def write(self, table:str, df:pd.DataFrame, key_columns:list[str]=None) -> pd.DataFrame:
+        self.grids[table] = dataframe_to_cell_rows(df)
+        self.writes += 1
+        return df
+
+    def write_changes(self, table:str, df:pd.DataFrame, changed:np.ndarray, key_columns:list[str]=None) -> pd.DataFrame:
+        grid = self.grids.get(table)
+        if grid is None or len(grid) - 1 > len(df):
+            return self.write(table, df, key_columns=key_columns)
+        header, *changed_rows = dataframe_to_cell_rows(df[changed])
+        if grid[0] != header:
+            return self.write(table, df, key_columns=key_columns)
+        grid.extend([()] * (len(df) + 1 - len(grid)))
+        for position, row in zip(np.flatnonzero(changed), changed_rows):
+            grid[position + 1] = row
+        self.writes += 1
+        return df
+
+def make_sinks(creds) -> tuple[WarehouseSink, WarehouseSink, str]:
+    # (warehouse sink, merged data sink, merged data table) for the configured WAREHOUSE_BACKEND
+    backend = getattr(settings, "WAREHOUSE_BACKEND", "sheets")
+    match backend:
+        case "sheets":
+            return (GoogleSheetsSink(creds, settings.WAREHOUSE_DATA_SPS_ID),
+                    GoogleSheetsSink(creds, settings.MERGED_DATA_SPS_ID),
+                    "main")
+        case "sqlite":
+            sink = SQLiteSink(getattr(settings, "WAREHOUSE_SQLITE_PATH", "warehouse.sqlite"))
+            return sink, sink, "merged_data"
+        case "memory":
+            sink = InMemorySheetsSink()
+            return sink, sink, "merged_data"
+        case _:
+            raise Exception(f"Invalid Warehouse Backend '{backend}'")
+
+class DimensionSpec:
+    """How a dimension table is built from the master data.
+
+    source picks (or joins) the master tables, columns renames master columns to dimension columns,
+    business_key is the dimension column rows are matched on, and normalize_key brings keys read back
+    from the warehouse and keys from the master to the same text form.
+    """
+    def __init__(self, table:str, business_key:str, columns:dict[str, str], source, normalize_key=None):
+        self.table = table
+        self.business_key = business_key
+        self.columns = columns
+        self.source = source
+        self.normalize_key = normalize_key or (lambda keys: keys)
+
+    @property
+    def attributes(self) -> list[str]:
+        # Dimension columns besides the surrogate and business keys, in warehouse order
+        return [column for column in WAREHOUSE_COLUMNS[self.table] if column not in ("id", self.business_key)]
+
+def location_source(master_data:tuple[pd.DataFrame, ...]) -> pd.DataFrame:
+    master_area_df, master_inc_province_df, _, _ = master_data
+    raise_for_report(validate_master_data(master_data))
+    return master_area_df.merge(master_inc_province_df, left_on="AREA_NAME", right_on="Provinsi", how="left")
+
+DIMENSION_SPECS = {
+    "dim_year": DimensionSpec("dim_year", "year",
+                              {"Year": "year", "Notes": "note"},
+                              source=lambda master_data: master_data[2],
+                              normalize_key=lambda keys: keys.astype(int).astype(str)),
+    "dim_location": DimensionSpec("dim_location", "area_code",
+                                  {"ID": "area_code",
+                                   "AREA_NAME": "area_name",
+                                   "AREA_TYPE": "area_type",
+                                   "REGION_GROUP": "region_name",
+                                   "ID_REGION": "region_code",
+                                   "Tingkat_Pendapatan": "income_level_name",
+                                   "ID_Pendapatan": "income_level_code"},
+                                  source=location_source,
+                                  normalize_key=lambda keys: keys.astype(int).astype(str).str.zfill(2)),
+    "dim_indicator": DimensionSpec("dim_indicator", "indicator_code",
+                                   {"Indicator_Code": "indicator_code",
+                                    "Indicator_Name": "indicator_name",
+                                    "Category_ID": "category_id",
+                                    "Category": "category_name",
+                                    "Sub_Category_ID": "sub_category_id",
+                                    "Sub_Category": "sub_category_name",
+                                    "Area_ID": "area_type_id",
+                                    "Area_Type": "area_type_name",
+                                    "Unit": "unit"},
+                                   source=lambda master_data: master_data[3]),
+}
+
+SCD2_COLUMNS = ["effective_from", "effective_to", "is_current"]
+
+def row_hashes(df:pd.DataFrame) -> np.ndarray:
+    # Content hash of every row, taken on the values as a worksheet stores them, so 3, 3.0 and "3"
+    # (as read back from a sheet or from a master) hash alike
+    canonical = pd.DataFrame({column: [repr(to_cell_value(value)) for value in df[column].to_numpy(dtype=object)]
+                              for column in df.columns})
+    return pd.util.hash_pandas_object(canonical, index=False).to_numpy()
+
+def current_dimension_rows(dim:pd.DataFrame) -> pd.DataFrame:
+    # The row facts point to for every business key: all rows of an SCD type 1 dimension,
+    # the current version of an SCD type 2 one
+    if "is_current" not in dim.columns:
+        return dim
+    return dim[dim["is_current"].to_numpy(dtype=bool)]
+
+def read_is_current(values:pd.Series) -> pd.Series:
+    # TRUE/FALSE cells come back as booleans, as 1/0 or as text depending on the sink
+    return values.map(lambda value: str(value).upper() in ("TRUE", "1", "1.0")).astype(bool)
+
+def handle_dimension(sink:WarehouseSink,
+                     spec:DimensionSpec,
+                     dim:pd.DataFrame,
+                     master_data:tuple[pd.DataFrame, ...],
+                     default_null_value:str,
+                     scd_type:int=1,
+                     as_of:str=None) -> pd.DataFrame:
+    """Merges the master rows of a dimension into its warehouse table and writes only the rows that changed.
+
+    Rows are matched on the business key and compared by content hash. Existing rows keep their id and
+    position, new keys get the next ids. With scd_type=1 a changed row is overwritten; with scd_type=2 it is
+    closed (effective_to, is_current) and its new version is appended under a new id, and only the current
+    versions are compared, so the history is never rescanned. Keys missing from the master are kept.
+    """
+    key = spec.business_key
+    attributes = spec.attributes
+    as_of = as_of or time.strftime("%Y-%m-%d")
+    columns = ["id", key] + attributes + (SCD2_COLUMNS if scd_type == 2 else [])
+
+    source = spec.source(master_data).rename(columns=spec.columns)[[key] + attributes].fillna(default_null_value)
+    source[key] = spec.normalize_key(source[key])
+    source = source.drop_duplicates(subset=[key], keep="last").reset_index(drop=True)
+
+    existing = dim.reset_index(drop=True)
+    layout_changed = list(existing.columns) != columns
+    if scd_type == 2:
+        if "is_current" not in existing.columns:
+            # Switching an SCD type 1 table to type 2: every row is the current version of its key
+            existing = existing.assign(effective_from=np.nan, effective_to=np.nan, is_current=True)
+        existing["is_current"] = read_is_current(existing["is_current"])
+    elif "is_current" in existing.columns:
+        raise Exception(f"{spec.table} holds SCD type 2 history, set it back to type 2 or rebuild it")
+    existing = existing.reindex(columns=columns)
+    existing[key] = spec.normalize_key(existing[key])
+
+    current = current_dimension_rows(existing)
+    if not pd.Index(current[key]).is_unique:
+        duplicates = current[key][current[key].duplicated()].unique().tolist()
+        raise Exception(f"Duplicate {key} in {spec.table}: {duplicates[:20]}")
+
+    source_index = pd.Index(source[key])
+    positions = source_index.get_indexer(current[key])
+    matched = positions >= 0
+    source_hashes = row_hashes(source[attributes])
+    differs = row_hashes(current.loc[matched, attributes]) != source_hashes[positions[matched]]
+    updated_rows = current.index[matched][differs].to_numpy()
+    updated_sources = positions[matched][differs]
+    inserted_sources = np.flatnonzero(~source_index.isin(current[key]))
+
+    changed = np.zeros(len(existing), dtype=bool)
+    changed[updated_rows] = True
+    next_id = int(pd.to_numeric(existing["id"]).max()) + 1 if len(existing) else 1
+    if scd_type == 2:
+        # Close the old versions, their new versions are appended with the new keys
+        existing["effective_to"] = existing["effective_to"].astype(object)
+        existing.loc[updated_rows, "effective_to"] = as_of
+        existing.loc[updated_rows, "is_current"] = False
+        appended = source.iloc[np.concatenate([updated_sources, inserted_sources])]
+        appended = appended.assign(effective_from=as_of, effective_to=np.nan, is_current=True)
+    else:
+        for column in attributes:
+            values = existing[column].to_numpy(dtype=object).copy()
+            values[updated_rows] = source[column].to_numpy(dtype=object)[updated_sources]
+            existing[column] = values
+        appended = source.iloc[inserted_sources]
+    appended = appended.assign(id=np.arange(next_id, next_id + len(appended)))[columns]
+
+    final_dim = pd.concat([existing, appended], ignore_index=True).infer_objects()
+    final_dim["id"] = final_dim["id"].astype("int64")
+    changed = np.concatenate([changed, np.ones(len(appended), dtype=bool)])
+    print(f"{spec.table}: {len(updated_rows)} UPDATED, {len(inserted_sources)} NEW, {len(current) - len(updated_rows)} UNCHANGED")
+
+    key_columns = ["id"] if scd_type == 2 else [key]
+    if layout_changed:
+        sink.write(spec.table, final_dim, key_columns=key_columns)
+    else:
+        sink.write_changes(spec.table, final_dim, changed, key_columns=key_columns)
+    return final_dim
+
+def classify_by_thresholds(values:pd.Series,
+                           thresholds:list[pd.Series],
+                           labels:list[str],
+                           default_label:str,
+                           exclude:pd.Series=None) -> pd.Series:
+    # The first label whose threshold the value exceeds wins, otherwise default_label.
+    # Missing values and excluded rows get NaN.
+    value_array = values.to_numpy(dtype=float)
+    conditions = [value_array > threshold.to_numpy(dtype=float) for threshold in thresholds]
+    classes = np.select(conditions, labels, default=default_label).astype(object)
+    skip = np.isnan(value_array)
+    if exclude is not None:
+        skip |= exclude.to_numpy(dtype=bool)
+    classes[skip] = np.nan
+    return pd.Series(classes, index=values.index)
+
+class KeyIndex:
+    """Hash index over a table's business key, built once and probed with Index.get_indexer."""
+    def __init__(self, table_name:str, table:pd.DataFrame, key_column:str):
+        self.table_name = table_name
+        self.table = table
+        self.key_column = key_column
+        self.index = pd.Index(table[key_column])
+        if not self.index.is_unique:
+            duplicates = self.index[self.index.duplicated()].unique().tolist()
+            raise Exception(f"Duplicate {key_column} in {table_name}: {duplicates[:20]}")
+
+    def positions(self, keys:pd.Series) -> np.ndarray:
+        # Row of the table holding every key, -1 where there is none
+        return self.index.get_indexer(keys)
+
+    def take(self, column:str, positions:np.ndarray) -> np.ndarray:
+        # NaN where the position is -1
+        return pd.api.extensions.take(self.table[column].to_numpy(), positions, allow_fill=True)
+
+def report_unmatched_keys(key_index:KeyIndex, keys:pd.Series, positions:np.ndarray) -> list:
+    unmatched_keys = sorted(map(str, keys[positions < 0].unique()))
+    if unmatched_keys:
+        print(f"WARNING: {(positions < 0).sum()} FACT ROW(S) DROPPED, {key_index.key_column} NOT FOUND IN {key_index.table_name}: "
+              f"{unmatched_keys[:20]}{' . . .' if len(unmatched_keys) > 20 else ''}")
+    return unmatched_keys
+
+FACT_COLUMNS = ["dim_year_id", "dim_indicator_id", "dim_location_id", "value", "relative_value"]
+
+def enrich_fact_rows(fact_value:pd.DataFrame,
+                     dim_location:pd.DataFrame,
+                     dim_indicator:pd.DataFrame,
+                     dim_year:pd.DataFrame,
+                     master_indicator_df:pd.DataFrame) -> pd.DataFrame:
+    # One row per fact_value row, in the same order: FACT_COLUMNS plus "matched", False where a key is
+    # missing from a dimension (those rows have NaN ids and are not loaded)
+    # FORMAT SOURCE
+    area_code = fact_value["Area Code"].astype(int).astype(str).str.zfill(2)
+    year = fact_value["Year"].astype(int).astype(str)
+    indicator_code = fact_value["Indicator Code"]
+
+    # Surrogate keys and thresholds are looked up by business key instead of joined in, rows whose key is
+    # missing from a dimension are reported and left out (as the inner joins did). Thresholds of an indicator
+    # listed twice in the master come from its last row, as in dim_indicator.
+    location_index = KeyIndex("dim_location", current_dimension_rows(dim_location), "area_code")
+    year_index = KeyIndex("dim_year", current_dimension_rows(dim_year), "year")
+    indicator_index = KeyIndex("dim_indicator", current_dimension_rows(dim_indicator), "indicator_code")
+    threshold_index = KeyIndex("master indicator",
+                               master_indicator_df.drop_duplicates(subset=["Indicator_Code"], keep="last"),
+                               "Indicator_Code")
+    lookups = [(location_index, area_code), (year_index, year), (indicator_index, indicator_code), (threshold_index, indicator_code)]
+    positions = [key_index.positions(keys) for key_index, keys in lookups]
+    for (key_index, keys), key_positions in zip(lookups, positions):
+        report_unmatched_keys(key_index, keys, key_positions)
+    location_positions, year_positions, indicator_positions, threshold_positions = positions
+
+    fact_rows = pd.DataFrame({"dim_year_id": year_index.take("id", year_positions),
+                              "dim_indicator_id": indicator_index.take("id", indicator_positions),
+                              "dim_location_id": location_index.take("id", location_positions),
+                              "value": fact_value["Value"].to_numpy()})
+    # National aggregate rows (area code "00") are not graded
+    fact_rows["relative_value"] = classify_by_thresholds(fact_rows.value,
+                                                         [pd.Series(threshold_index.take(f"Threshold Grade {grade}", threshold_positions))
+                                                          for grade in ["A", "B", "C"]],
+                                                         labels=["A", "B", "C"],
+                                                         default_label="D",
+                                                         exclude=pd.Series(area_code.to_numpy() == "00"))
+    fact_rows["matched"] = np.logical_and.reduce([key_positions >= 0 for key_positions in positions])
+    return fact_rows
+
+def load_fact_rows(sink:WarehouseSink, fact_rows:pd.DataFrame, changed:np.ndarray=None) -> pd.DataFrame:
+    # Rows stay in source order (area, indicator, year), so while the master data and dimension ids are
+    # unchanged every row keeps its position from run to run. changed, aligned with fact_rows, marks the
+    # rows that differ from the last load; only those are written. Without it the whole table is written.
+    matched = fact_rows.matched.to_numpy(dtype=bool)
+    fact_table = fact_rows.loc[matched, FACT_COLUMNS].reset_index(drop=True)
+    fact_table = fact_table.astype({"dim_year_id": "int64", "dim_indicator_id": "int64", "dim_location_id": "int64"})
+    key_columns = ["dim_year_id", "dim_indicator_id", "dim_location_id"]
+    if changed is None:
+        sink.write("fact_it_ecosystem", fact_table, key_columns=key_columns)
+    else:
+        sink.write_changes("fact_it_ecosystem", fact_table, changed[matched], key_columns=key_columns)
+    return fact_table
+
+def handle_fact_value(sink:WarehouseSink,
                       fact_value:pd.DataFrame,
                       dim_location:pd.DataFrame,
                       dim_indicator:pd.DataFrame,
                       dim_year:pd.DataFrame,
                       master_indicator_df:pd.DataFrame) -> pd.DataFrame:
-    fact_it_eco_column = [
-        "dim_year_id",
-        "dim_indicator_id",
-        "dim_location_id",
-        "value",
-        "relative_value"
-    ]
-    renamed_source = fact_value.rename(columns={"Area Code":"area_code",
-                                                   "Area":"area_name",
-                                                   "Indicator Code":"indicator_code",
-                                                   "Indicator Name":"indicator_name",
-                                                   "Unit":"unit",
-                                                   "Year":"year",
-                                                   "Value":"value"})
+    return load_fact_rows(sink, enrich_fact_rows(fact_value, dim_location, dim_indicator, dim_year, master_indicator_df))
 
+class RollupSpec:
+    """A summary table of fact_it_ecosystem, grouped by the dimension attributes in front of its measures.
 
-    # FORMAT SOURCE
-    renamed_source["area_code"] = renamed_source["area_code"].astype(int).astype(str).apply(lambda x : x.zfill(2))
-    renamed_source["year"] = renamed_source["year"].astype(int).astype(str)
-
-    # renamed_source
-    enriched_df = pd.merge(renamed_source.drop(columns="area_name"), dim_location, on="area_code").rename(columns={"id":"dim_location_id"})
-    enriched_df = pd.merge(enriched_df, dim_year, on="year").rename(columns={"id":"dim_year_id"})
-    enriched_df = pd.merge(enriched_df.drop(columns=["indicator_name", "unit"]), dim_indicator, on="indicator_code").rename(columns={"id":"dim_indicator_id"})
-    enriched_df = enriched_df.merge(master_indicator_df.rename(columns={"Indicator_Code":"indicator_code"})[["indicator_code",
-                                                                                                             "Threshold Grade A",
-                                                                                                             "Threshold Grade B",
-                                                                                                             "Threshold Grade C"]], 
-                                    how="inner", 
-                                    on="indicator_code")
-    def handle_rel_value(value,
-                     tgA,
-                     tgB,
-                     tgC,
-                     area_code):
-        if math.isnan(value) or area_code == "00": return np.nan
-        if value > tgA:
-            return "A"
-        elif value > tgB:
-            return "B"
-        elif value > tgC:
-            return "C"
+    National tables leave out the national aggregate rows (area code "00"), which would count every
+    province twice; region tables keep them under their own region.
+    """
+    def __init__(self, table:str, national:bool=False):
+        self.table = table
+        self.national = national
+
+    @property
+    def group_columns(self) -> list[str]:
+        return WAREHOUSE_COLUMNS[self.table][:-len(ROLLUP_MEASURES)]
+
+ROLLUP_SPECS = {
+    "rollup_region_category": RollupSpec("rollup_region_category"),
+    "rollup_region_sub_category": RollupSpec("rollup_region_sub_category"),
+    "rollup_national_category": RollupSpec("rollup_national_category", national=True),
+    "rollup_national_sub_category": RollupSpec("rollup_national_sub_category", national=True),
+}
+
+ROLLUP_GROUP_COLUMNS = ["region_code", "region_name", "category_id", "category_name",
+                        "sub_category_id", "sub_category_name", "year", "national_row"]
+
+def rollup_key_codes(columns:dict[str, pd.Series], positions:np.ndarray) -> tuple[pd.DataFrame, np.ndarray]:
+    # The distinct combinations of the group columns over the dimension rows, and the combination of the
+    # dimension row at every position. Position -1 (no such row) gets an all-missing combination.
+    keys = pd.DataFrame(columns)
+    codes = keys.groupby(list(keys.columns), dropna=False, sort=False).ngroup().to_numpy()
+    combinations = pd.concat([keys.drop_duplicates(), pd.DataFrame(index=[-1], columns=keys.columns)], ignore_index=True)
+    return combinations, np.append(codes, len(combinations) - 1)[positions]
+
+def rollup_key_values(values:pd.Series) -> pd.Series:
+    # Keys read back from a sheet come as 3.0 or "3" where the master has 3, they are grouped on the value
+    # a worksheet would hold; whole-number keys stay integers
+    values = values.map(lambda value: None if (cell := to_cell_value(value)) is None else cell[1]).infer_objects()
+    if values.dtype == float and values.notna().all() and (values % 1 == 0).all():
+        values = values.astype("int64")
+    return values.reset_index(drop=True)
+
+def rollup_partials(fact_table:pd.DataFrame,
+                    dim_location:pd.DataFrame,
+                    dim_indicator:pd.DataFrame,
+                    dim_year:pd.DataFrame) -> pd.DataFrame:
+    # One pass over the fact table: count, sum, min, max and grade counts per region x sub category x year,
+    # which every rollup table is then aggregated from. Facts point to dimension rows by id (any version
+    # of an SCD type 2 row). The group keys are normalized on the small dimension tables and every fact
+    # only carries the integer code of its combination, so the pass groups on three integer columns.
+    location_keys, location_code = rollup_key_codes(
+        {"region_code": rollup_key_values(dim_location.region_code),
+         "region_name": rollup_key_values(dim_location.region_name),
+         "national_row": DIMENSION_SPECS["dim_location"].normalize_key(dim_location.area_code).to_numpy() == "00"},
+        KeyIndex("dim_location", dim_location, "id").positions(fact_table.dim_location_id))
+    indicator_keys, indicator_code = rollup_key_codes(
+        {column: rollup_key_values(dim_indicator[column])
+         for column in ["category_id", "category_name", "sub_category_id", "sub_category_name"]},
+        KeyIndex("dim_indicator", dim_indicator, "id").positions(fact_table.dim_indicator_id))
+    year_keys, year_code = rollup_key_codes(
+        {"year": rollup_key_values(dim_year.year)},
+        KeyIndex("dim_year", dim_year, "id").positions(fact_table.dim_year_id))
+    relative_value = fact_table.relative_value.to_numpy(dtype=object)
+    facts = pd.DataFrame({"location": location_code,
+                          "indicator": indicator_code,
+                          "year": year_code,
+                          "value": pd.to_numeric(fact_table.value, errors="coerce").to_numpy()})
+    for grade in ["A", "B", "C", "D"]:
+        facts[f"grade_{grade.lower()}_count"] = (relative_value == grade).astype("int64")
+    partials = facts.groupby(["location", "indicator", "year"], sort=False).agg(
+        value_count=("value", "count"),
+        value_sum=("value", "sum"),
+        min_value=("value", "min"),
+        max_value=("value", "max"),
+        grade_a_count=("grade_a_count", "sum"),
+        grade_b_count=("grade_b_count", "sum"),
+        grade_c_count=("grade_c_count", "sum"),
+        grade_d_count=("grade_d_count", "sum"),
+    ).reset_index()
+    keys = pd.concat([location_keys.take(partials.location).reset_index(drop=True),
+                      indicator_keys.take(partials.indicator).reset_index(drop=True),
+                      year_keys.take(partials.year).reset_index(drop=True)], axis=1)
+    return pd.concat([keys[ROLLUP_GROUP_COLUMNS], partials.drop(columns=["location", "indicator", "year"])], axis=1)
+
+def build_rollup(spec:RollupSpec, partials:pd.DataFrame) -> pd.DataFrame:
+    # Rows sorted by group, so a table keeps its row order from run to run while its groups stay the same;
+    # a key column mixing numbers and text (e.g. DEFAULT_NULL_VALUE) is sorted as text
+    if spec.national:
+        partials = partials[~partials.national_row.to_numpy(dtype=bool)]
+    rollup = partials.groupby(spec.group_columns, dropna=False, sort=False).agg(
+        value_count=("value_count", "sum"),
+        value_sum=("value_sum", "sum"),
+        min_value=("min_value", "min"),
+        max_value=("max_value", "max"),
+        grade_a_count=("grade_a_count", "sum"),
+        grade_b_count=("grade_b_count", "sum"),
+        grade_c_count=("grade_c_count", "sum"),
+        grade_d_count=("grade_d_count", "sum"),
+    ).reset_index()
+    rollup["mean_value"] = rollup.value_sum / rollup.value_count.where(rollup.value_count > 0)
+    rollup = rollup.sort_values(spec.group_columns,
+                                key=lambda keys: keys if pd.api.types.is_numeric_dtype(keys) else keys.astype(str),
+                                kind="stable")
+    return rollup[WAREHOUSE_COLUMNS[spec.table]].reset_index(drop=True)
+
+def publish_rollups(sink:WarehouseSink,
+                    fact_table:pd.DataFrame,
+                    dim_location:pd.DataFrame,
+                    dim_indicator:pd.DataFrame,
+                    dim_year:pd.DataFrame,
+                    state_path:str=None,
+                    full_refresh:bool=False) -> dict[str, pd.DataFrame]:
+    """Aggregates the fact table into the rollup tables and writes the groups whose figures changed.
+
+    The tables as last published are kept at state_path. While a table has the same groups as then, only
+    its rows with a changed figure are written (sink.write_changes); otherwise, without state or on a full
+    refresh, the whole table goes through sink.write, which on Sheets still only rewrites the rows that differ.
+    """
+    partials = rollup_partials(fact_table, dim_location, dim_indicator, dim_year)
+    previous = dict()
+    if state_path and not full_refresh and os.path.exists(state_path):
+        previous = pd.read_pickle(state_path)
+    rollups = dict()
+    for table, spec in ROLLUP_SPECS.items():
+        rollup = build_rollup(spec, partials)
+        published = previous.get(table)
+        if published is None or not published[spec.group_columns].equals(rollup[spec.group_columns]):
+            print(f"{table}: {len(rollup)} GROUPS, WRITING THE WHOLE TABLE")
+            sink.write(table, rollup, key_columns=spec.group_columns)
+        else:
+            changed = row_hashes(published) != row_hashes(rollup)
+            print(f"{table}: {changed.sum()} OF {len(rollup)} GROUPS CHANGED")
+            sink.write_changes(table, rollup, changed, key_columns=spec.group_columns)
+        rollups[table] = rollup
+    if state_path:
+        # Saved once every table is written, a failed write leaves the previous state in place
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        pd.to_pickle(rollups, state_path + ".tmp")
+        os.replace(state_path + ".tmp", state_path)
+    return rollups
+
+def value_fingerprints(values:pd.Series) -> np.ndarray:
+    # Text and numbers that print alike ("12.5" and 12.5) convert differently, so the type is hashed too
+    is_text = values.apply(isinstance, args=(str,)).astype(bool)
+    return pd.util.hash_pandas_object(pd.DataFrame({"value": values.to_numpy(), "is_text": is_text.to_numpy()}),
+                                      index=False).to_numpy()
+
+def patch_rows(df:pd.DataFrame, mask:np.ndarray, rows:pd.DataFrame) -> pd.DataFrame:
+    # df with the rows under mask replaced by rows, in order; each column gets a dtype holding both
+    kept = ~mask
+    source = np.where(mask, kept.sum() + np.cumsum(mask) - 1, np.cumsum(kept) - 1)
+    return pd.concat([df[kept], rows], ignore_index=True).take(source).reset_index(drop=True)
+
+# Bumped when the state or the fact table layout it describes changes, older state is then ignored
+CDC_STATE_VERSION = 2
+
+class ChangeDataCapture:
+    """Which rows of the merged source data changed since the last successful run.
+
+    Every row of the master cross product gets a fingerprint of its source value. The converted values and
+    enriched fact rows of the last run are kept aligned with the same rows, so a run only converts and
+    enriches the rows whose fingerprint changed and patches them in. A change to the master data (and so to
+    the cross product) or to the dimension ids makes it start from scratch. After enrich, changed_fact_rows
+    marks the fact rows that differ from the last load, or is None when they were all rebuilt.
+    """
+    def __init__(self, directory:str, merged_df:pd.DataFrame, master_data:tuple[pd.DataFrame, ...], full_refresh:bool=False):
+        self.path = os.path.join(directory, "state.pkl")
+        self.master = hashlib.sha256("".join(map(frame_fingerprint, master_data)).encode()).hexdigest()
+        self.fingerprints = value_fingerprints(merged_df.Value)
+        self.dimensions:str = None
+        self.previous:dict = None
+        self.changed_fact_rows:np.ndarray = None
+        if not full_refresh and os.path.exists(self.path):
+            previous = pd.read_pickle(self.path)
+            if (previous.get("version") == CDC_STATE_VERSION
+                and previous["master"] == self.master
+                and len(previous["fingerprints"]) == len(self.fingerprints)):
+                self.previous = previous
+        # None when every row has to be computed
+        self.changed:np.ndarray = None if self.previous is None else self.fingerprints != self.previous["fingerprints"]
+        if self.changed is None:
+            print("CDC: NO STATE FROM THE LAST RUN OR THE MASTER DATA CHANGED, PROCESSING ALL ROWS")
+        else:
+            print(f"CDC: {self.changed.sum()} OF {len(self.changed)} ROWS CHANGED SINCE THE LAST RUN")
+
+    def convert(self, merged_df:pd.DataFrame) -> pd.DataFrame:
+        if self.changed is None:
+            return convert_value_dataframe(merged_df)
+        converted_result = merged_df.copy(deep=True)
+        values = self.previous["converted_values"].copy()
+        if self.changed.any():
+            values[self.changed] = convert_value_dataframe(merged_df[self.changed]).Value.to_numpy()
+        converted_result["Value"] = values
+        return converted_result
+
+    def enrich(self,
+               converted_result:pd.DataFrame,
+               dim_location:pd.DataFrame,
+               dim_indicator:pd.DataFrame,
+               dim_year:pd.DataFrame,
+               master_indicator_df:pd.DataFrame) -> pd.DataFrame:
+        dimensions = [(dim_location, "area_code"), (dim_year, "year"), (dim_indicator, "indicator_code")]
+        self.dimensions = hashlib.sha256("".join(frame_fingerprint(current_dimension_rows(dim)[["id", key]]) for dim, key in dimensions).encode()).hexdigest()
+        if self.changed is None or self.previous["dimensions"] != self.dimensions:
+            self.changed_fact_rows = None
+            return enrich_fact_rows(apply_merged_data_schema(converted_result), dim_location, dim_indicator, dim_year, master_indicator_df)
+        self.changed_fact_rows = self.changed
+        if not self.changed.any():
+            fact_rows = self.previous["fact_rows"]
         else:
-            return "D"
+            changed_rows = enrich_fact_rows(apply_merged_data_schema(converted_result[self.changed]),
+                                            dim_location, dim_indicator, dim_year, master_indicator_df)
+            fact_rows = patch_rows(self.previous["fact_rows"], self.changed, changed_rows)
+        # enrich_fact_rows only reported the keys of the changed rows, rows that stay unmatched are counted here
+        unmatched = int((~fact_rows.matched.to_numpy(dtype=bool)).sum())
+        if unmatched:
+            print(f"WARNING: {unmatched} FACT ROW(S) NOT LOADED, THEIR KEYS ARE MISSING FROM THE DIMENSIONS "
+                  f"(--full-refresh LISTS THE KEYS)")
+        return fact_rows
+
+    def save(self, converted_result:pd.DataFrame, fact_rows:pd.DataFrame):
+        # Only called once the fact table is loaded, a failed run leaves the previous state in place
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        pd.to_pickle({"version": CDC_STATE_VERSION,
+                      "master": self.master,
+                      "dimensions": self.dimensions,
+                      "fingerprints": self.fingerprints,
+                      "converted_values": converted_result.Value.to_numpy(),
+                      "fact_rows": fact_rows},
+                     self.path + ".tmp")
+        os.replace(self.path + ".tmp", self.path)
+
+class WarehouseRevision:
+    """Whether the warehouse still holds what this machine loaded into it at the end of its last run.
+
+    Incremental loads write only the rows that differ from the local CDC and rollup state, which is right
+    only while nobody else (another machine, an edit by hand) has written the warehouse since. The sink's
+    revision is read before the run writes anything and compared with the one saved after the last
+    successful run; save() records the new one once every table is loaded.
+    """
+    def __init__(self, sink:WarehouseSink, path:str):
+        self.sink = sink
+        self.path = path
+        saved = None
+        if os.path.exists(path):
+            with open(path) as state_file:
+                saved = json.load(state_file)["revision"]
+        current = sink.revision()
+        self.unchanged = current is not None and current == saved
+        if saved is not None and not self.unchanged:
+            print("WAREHOUSE WRITTEN ELSEWHERE SINCE THE LAST RUN, TABLES ARE DIFFED AGAINST ITS CONTENT")
+
+    def save(self):
+        revision = self.sink.revision()
+        if revision is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w") as state_file:
+            json.dump({"revision": revision}, state_file)
+        os.replace(self.path + ".tmp", self.path)
+
+class Stage:
+    """A pipeline step, called with the outputs of the stages it depends on, in order."""
+    def __init__(self, name:str, func, dependencies:tuple[str, ...]=()):
+        self.name = name
+        self.func = func
+        self.dependencies = dependencies
+
+def run_instrumented_stage(stage:Stage, args:list, profile_dir:str=None):
+    # Thread CPU time is the stage's own thread only. Process CPU time also covers the worker threads it
+    # starts (e.g. extraction), but so it does any stage running at the same time; the same goes for the
+    # sampled memory peak. Run the stages one at a time (--profile) to tell them apart.
+    profiler = cProfile.Profile() if profile_dir else None
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    started_wall, started_thread_cpu, started_process_cpu = time.perf_counter(), time.thread_time(), time.process_time()
+    status = "failed"
+    rss_sampler = RssSampler()
+    try:
+        with rss_sampler:
+            if profiler is not None:
+                profiler.enable()
+            result = stage.func(*args)
+        status = "completed"
+        return result
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile_dir, f"{stage.name}.prof"))
+        RUN_METRICS.record_stage(stage.name,
+                                 time.perf_counter() - started_wall,
+                                 time.thread_time() - started_thread_cpu,
+                                 time.process_time() - started_process_cpu,
+                                 rss_sampler.peak,
+                                 status)
 
-    enriched_df["relative_value"] = enriched_df.apply(lambda row: handle_rel_value(row.value,
-                                                    row["Threshold Grade A"],
-                                                    row["Threshold Grade B"],
-                                                    row["Threshold Grade C"],
-                                                    row.area_code), axis=1)
+def run_stages(stages:list[Stage],
+               checkpoint_dir:str,
+               resume:bool=False,
+               max_workers:int=4,
+               profile_dir:str=None,
+               rerun:set[str]=frozenset()) -> dict[str, object]:
+    # Every stage starts as soon as its dependencies are done, so independent stages run concurrently.
+    # Each output is pickled to checkpoint_dir; on resume, a stage whose checkpoint exists and whose
+    # dependencies were all restored too is loaded instead of run again, except for the stages in rerun
+    # (and so everything downstream of them).
+    # With profile_dir, every stage is cProfiled to <stage>.prof and stages run one at a time, so
+    # profiles and traced memory peaks are not mixed between stages.
+    stages_by_name = {stage.name: stage for stage in stages}
+    checkpoint_path = lambda name: os.path.join(checkpoint_dir, f"{name}.pkl")
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    results:dict[str, object] = dict()
+    if resume:
+        for stage in stages:
+            if (stage.name not in rerun
+                and os.path.exists(checkpoint_path(stage.name))
+                and all(dependency in results for dependency in stage.dependencies)):
+                results[stage.name] = pd.read_pickle(checkpoint_path(stage.name))
+                RUN_METRICS.record_stage(stage.name, 0.0, 0.0, 0.0, None, "restored")
+        if results:
+            print(f"RESUMING: {len(results)} STAGE(S) RESTORED FROM CHECKPOINT ({', '.join(results)})")
+    # Checkpoints of the stages about to run are out of date, a failed run must not leave them to be restored later
+    for stage in stages:
+        if stage.name not in results and os.path.exists(checkpoint_path(stage.name)):
+            os.remove(checkpoint_path(stage.name))
     
-    fact_table = enriched_df[fact_it_eco_column].sort_values(by=["value", "dim_indicator_id"])
-    write_data_to_sps(creds, settings.WAREHOUSE_DATA_SPS_ID, "fact_it_ecosystem", fact_table)
-    return fact_table
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+        max_workers = 1
+    pending = {name: stage for name, stage in stages_by_name.items() if name not in results}
+    failure:Exception = None
+    with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+        running:dict[Future, Stage] = dict()
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dependency in results for dependency in stage.dependencies):
+                    running[executor.submit(run_instrumented_stage,
+                                            stage,
+                                            [results[dependency] for dependency in stage.dependencies],
+                                            profile_dir)] = stage
+                    del pending[name]
+            if not running:
+                raise Exception(f"Unresolvable stage dependencies: {sorted(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except Exception as e:
+                    print(f"STAGE {stage.name} FAILED: {e}")
+                    # Nothing new is started, but stages already running still finish and get checkpointed
+                    failure = failure or e
+                    pending.clear()
+                    continue
+                pd.to_pickle(results[stage.name], checkpoint_path(stage.name))
+    if failure is not None:
+        print("Completed stages are checkpointed, rerun with --resume to continue from the failed stage.")
+        raise failure
+    return results
+
+class SharedResults:
+    """Values computed once per key and handed to every caller; concurrent callers wait for the first one."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures:dict[object, Future] = dict()
+
+    def get(self, key, compute):
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(compute())
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+def build_pipeline(creds,
+                   warehouse_sink:WarehouseSink,
+                   merged_sink:WarehouseSink,
+                   merged_table:str,
+                   full_refresh:bool=False,
+                   master_data_cache:SharedResults=None) -> list[Stage]:
+    column_to_rename = {
+        "ID":"Area Code",
+        "AREA_NAME":"Area",
+        "Indicator_Code":"Indicator Code",
+        "Indicator_Name":"Indicator Name",
+        "Unit":"Unit"
+    }
+    
+    def load_cleaned_data():
+        print("\nLoading cleaned data . . .")
+        cleaned_data:list[pd.DataFrame] = get_all_cleaned_data(creds, settings.CLEANED_DATA_DRIVE_FOLDER)
+        print(f"Loaded {len(cleaned_data)} cleaned data files.\n")
+        return cleaned_data
+    
+    def load_master_data():
+        print("Loading master data . . .")
+        if master_data_cache is None:
+            master_data = get_master_data(creds, settings.MASTER_WORKSHEET)
+        else:
+            # Pipelines of a batch reading the same master spreadsheets fetch them once; the frames are shared
+            # and never modified
+            master_data = master_data_cache.get((settings.MASTER_AREA_SPSID,
+                                                 settings.MASTER_INCOME_PROVINCE_SPSID,
+                                                 settings.MASTER_YEAR_SPSID,
+                                                 settings.MASTER_INDICATOR_SPSID,
+                                                 settings.MASTER_WORKSHEET),
+                                                lambda: get_master_data(creds, settings.MASTER_WORKSHEET))
+        print(f"Master data loaded successfully.\n")
+        return master_data
+    
+    def cross_merge(master_data):
+        master_area_df, _, master_year_df, master_indicator_df = master_data
+        return cross_merge_master(master_area_df, master_year_df, master_indicator_df, column_to_rename)
+    
+    def validate(cleaned_data, master_data):
+        print("Ensuring cleaned data is a subset of master data . . .")
+        report = validate_cleaned_data(cleaned_data, master_data)
+        raise_for_report(report)
+        print("Data validation passed.\n")
+        return report
+    
+    incremental = getattr(settings, "INCREMENTAL_CDC", True)
+    cdc_state_dir = getattr(settings, "CDC_STATE_DIR", os.path.join(".cache", "cdc"))
+    # Read before any stage writes to the warehouse
+    warehouse = WarehouseRevision(warehouse_sink, os.path.join(cdc_state_dir, "warehouse.json")) if incremental else None
+    
+    def source_changes(merged_df, master_data):
+        return ChangeDataCapture(cdc_state_dir,
+                                 merged_df,
+                                 master_data,
+                                 full_refresh=full_refresh or not incremental)
+    
+    scd2_dimensions = getattr(settings, "SCD_TYPE2_DIMENSIONS", [])
+    
+    def dimension(table:str):
+        def build(master_data):
+            final_dim = handle_dimension(warehouse_sink,
+                                         DIMENSION_SPECS[table],
+                                         warehouse_sink.read(table),
+                                         master_data,
+                                         settings.DEFAULT_NULL_VALUE,
+                                         scd_type=2 if table in scd2_dimensions else 1)
+            print(f"Final {table} columns: {final_dim.columns.tolist()}")
+            print(f"Final {table} rows: {len(final_dim)}")
+            return final_dim
+        return build
+    
+    def fact_value(converted_result, changes, final_dim_location, final_dim_indicator, final_dim_year, master_data):
+        fact_rows = changes.enrich(converted_result, final_dim_location, final_dim_indicator, final_dim_year, master_data[3])
+        # Changed rows only while the warehouse holds what the CDC state describes
+        changed = changes.changed_fact_rows if warehouse is not None and warehouse.unchanged else None
+        final_fact_value = load_fact_rows(warehouse_sink, fact_rows, changed=changed)
+        if incremental:
+            changes.save(converted_result, fact_rows)
+        print(f"Final fact_value columns: {final_fact_value.columns.tolist()}")
+        print(f"Final fact_value rows: {len(final_fact_value)}")
+        print(f"Final fact_value not null fact values (value): {final_fact_value.value.notnull().sum()}")
+        print(f"Final fact_value not null fact values (relative): {final_fact_value.relative_value.notnull().sum()}")
+        return final_fact_value
+    
+    def rollups(final_fact_value, final_dim_location, final_dim_indicator, final_dim_year):
+        if not getattr(settings, "PUBLISH_ROLLUPS", True):
+            print("Publishing rollup tables is disabled (PUBLISH_ROLLUPS).")
+            return None
+        # Without CDC every run starts from scratch, so the last published tables are not kept either
+        state_path = os.path.join(cdc_state_dir, "rollups.pkl") if incremental else None
+        print("Publishing rollup tables . . .")
+        return publish_rollups(warehouse_sink, final_fact_value, final_dim_location, final_dim_indicator, final_dim_year,
+                               state_path=state_path,
+                               full_refresh=full_refresh or warehouse is None or not warehouse.unchanged)
+    
+    return [
+        Stage("cleaned_data", load_cleaned_data),
+        Stage("concatenated", concatenate_cleaned_data, ("cleaned_data",)),
+        Stage("melted", melt_cleaned_data, ("concatenated",)),
+        Stage("master_data", load_master_data),
+        Stage("cross_merged", cross_merge, ("master_data",)),
+        Stage("validated", validate, ("cleaned_data", "master_data")),
+        Stage("merged", lambda cross_merged_df, melted_df, _: left_outer_merge_to_master(cross_merged_df, melted_df),
+              ("cross_merged", "melted", "validated")),
+        Stage("source_changes", source_changes, ("merged", "master_data")),
+        Stage("converted", lambda merged_df, changes: changes.convert(merged_df), ("merged", "source_changes")),
+        # Publishing the merged sheet is a side branch, it runs alongside the warehouse stages
+        Stage("published_merged", lambda converted_result: publish_merged_data(merged_sink, merged_table, converted_result),
+              ("converted",)),
+        Stage("dim_year", dimension("dim_year"), ("master_data",)),
+        Stage("dim_location", dimension("dim_location"), ("master_data",)),
+        Stage("dim_indicator", dimension("dim_indicator"), ("master_data",)),
+        Stage("fact_value", fact_value, ("converted", "source_changes", "dim_location", "dim_indicator", "dim_year", "master_data")),
+        Stage("rollups", rollups, ("fact_value", "dim_location", "dim_indicator", "dim_year")),
+    ] + ([
+        # Once every table is loaded, so the next run can tell whether anyone else wrote the warehouse since
+        Stage("warehouse_revision", lambda *_: warehouse.save(), ("fact_value", "rollups", "published_merged")),
+    ] if warehouse is not None else [])
+
+# Local state a pipeline keeps, with the default location; every pipeline of a batch gets its own
+PIPELINE_STATE_PATHS = {
+    "SNAPSHOT_CACHE_DIR": os.path.join(".cache", "snapshots"),
+    "STAGE_CHECKPOINT_DIR": os.path.join(".cache", "stages"),
+    "LOAD_CHECKPOINT_DIR": os.path.join(".cache", "checkpoints"),
+    "CDC_STATE_DIR": os.path.join(".cache", "cdc"),
+    "WATCH_STATE_PATH": os.path.join(".cache", "watch.json"),
+    "VALIDATION_REPORT_PATH": "validation_report.csv",
+    "WAREHOUSE_SQLITE_PATH": "warehouse.sqlite",
+}
+
+class PipelineConfig:
+    """One warehouse of a batch: a name and the settings that differ from settings.py for it.
+
+    The paths in PIPELINE_STATE_PATHS get the name as a suffix unless the overrides set them, so
+    pipelines never share snapshots, checkpoints, CDC state or a SQLite warehouse. Every pipeline has its
+    own run metrics.
+    """
+    def __init__(self, name:str, **overrides):
+        self.name = name
+        self.settings = dict(overrides)
+        # Name as it can appear in a file name
+        self.slug = re.sub(r"[^\w.-]", "_", name)
+        for setting, default in PIPELINE_STATE_PATHS.items():
+            if setting not in self.settings:
+                base, extension = os.path.splitext(getattr(settings, setting, default))
+                self.settings[setting] = f"{base}_{self.slug}{extension}"
+        self.metrics = RunMetrics()
+
+def run_batch(creds,
+              configs:list[PipelineConfig],
+              metrics_dir:str,
+              max_pipelines:int=4,
+              resume:bool=False,
+              full_refresh:bool=False) -> list[dict]:
+    """Runs several pipelines at once in this process and returns one summary row per pipeline.
+
+    They share the Sheets read rate limiter (one quota), the API clients and the master data, which is
+    fetched once per distinct set of master spreadsheets. A failed pipeline does not stop the others.
+    """
+    master_data_cache = SharedResults()
+    run_id = time.strftime("run_%Y%m%d-%H%M%S")
+
+    def run_pipeline(config:PipelineConfig) -> dict:
+        CURRENT_PIPELINE.set(config)
+        config.metrics.reset()
+        summary = {"pipeline": config.name, "status": "succeeded", "seconds": 0.0, "merged_rows": None,
+                   "fact_rows": None, "api_calls": 0, "retries": 0, "error": None}
+        started_at = time.perf_counter()
+        try:
+            warehouse_sink, merged_sink, merged_table = make_sinks(creds)
+            results = run_stages(build_pipeline(creds, warehouse_sink, merged_sink, merged_table,
+                                                full_refresh=full_refresh,
+                                                master_data_cache=master_data_cache),
+                                 settings.STAGE_CHECKPOINT_DIR,
+                                 resume=resume,
+                                 max_workers=getattr(settings, "STAGE_MAX_WORKERS", 4))
+            summary.update(merged_rows=len(results["converted"]), fact_rows=len(results["fact_value"]))
+        except Exception as e:
+            summary.update(status="failed", error=str(e).splitlines()[0] if str(e) else type(e).__name__)
+        finally:
+            summary["seconds"] = time.perf_counter() - started_at
+            metrics = config.metrics.to_dict()
+            summary["api_calls"] = sum(call["calls"] for call in metrics["api_calls"].values())
+            summary["retries"] = len(metrics["retries"])
+            config.metrics.save(os.path.join(metrics_dir, f"{run_id}_{config.slug}.json"))
+        return summary
+
+    with ContextThreadPoolExecutor(max_workers=max_pipelines) as executor:
+        summaries = list(executor.map(run_pipeline, configs))
+    print("\nBATCH SUMMARY")
+    print(pd.DataFrame(summaries).to_string(index=False))
+    return summaries
+
+class DriveChangeWatcher:
+    """Follows the Drive changes feed and tells which pipeline stages the changes make stale.
+
+    A change to one of the four master spreadsheets makes master_data stale, a change to a file in the
+    cleaned data folder (or one the last extraction read, so moves out of the folder and deletions count)
+    makes cleaned_data stale. poll() only moves the page token forward in memory; the caller saves it
+    once the changes read up to it are in the warehouse, so a restarted watcher reads again every change
+    it had not applied, including the edits made while it was down.
+    """
+    def __init__(self, service:Resource, state_path:str, master_ids:set[str], folder_id:str, snapshot_dir:str):
+        self.service = service
+        self.state_path = state_path
+        self.master_ids = master_ids
+        self.folder_id = folder_id
+        self.snapshot_dir = snapshot_dir
+        self.page_token:str = None
+
+    def start(self) -> bool:
+        # True when the watcher continues from a saved page token. A new one is saved after the first
+        # successful run, until then a restart starts over with a full run.
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                self.page_token = json.load(state_file)["page_token"]
+            return True
+        self.page_token = call_with_backoff(self.service.changes().getStartPageToken().execute)["startPageToken"]
+        return False
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as state_file:
+            json.dump({"page_token": self.page_token}, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    def stale_stage(self, change:dict, cleaned_ids:set[str]) -> str | None:
+        file = change.get("file", {})
+        if change["fileId"] in self.master_ids:
+            return "master_data"
+        if change["fileId"] in cleaned_ids or self.folder_id in file.get("parents", []):
+            return "cleaned_data"
+        return None
+
+    def poll(self) -> set[str]:
+        cleaned_ids = set(SnapshotCache(self.snapshot_dir).manifest)
+        stale_stages = set()
+        while True:
+            response = call_with_backoff(self.service.changes().list(
+                pageToken=self.page_token,
+                pageSize=1000,
+                includeRemoved=True,
+                fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, parents, trashed))").execute)
+            stale_stages.update(self.stale_stage(change, cleaned_ids) for change in response.get("changes", []))
+            if "nextPageToken" in response:
+                self.page_token = response["nextPageToken"]
+                continue
+            self.page_token = response["newStartPageToken"]
+            return stale_stages - {None}
+
+class ChangeNotificationChannel:
+    """Drive push notifications for the changes feed, received on a local HTTP server.
+
+    A notification only wakes the watch loop up, the changes themselves are still read from the feed.
+    address is the public HTTPS URL Drive posts to, forwarded to port on this machine. The channel is
+    renewed before it expires.
+    """
+    def __init__(self, service:Resource, address:str, port:int, wake:threading.Event):
+        self.service = service
+        self.address = address
+        self.wake = wake
+        self.token = hashlib.sha256(os.urandom(32)).hexdigest()
+        self.channel:dict = None
+        channel = self
+
+        class NotificationHandler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.headers.get("X-Goog-Channel-Token") == channel.token:
+                    if self.headers.get("X-Goog-Resource-State") != "sync":
+                        channel.wake.set()
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("", port), NotificationHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def ensure_registered(self, page_token:str):
+        # Drive channels on the changes feed last a week at most, a new one is opened an hour before expiry
+        if self.channel is not None and int(self.channel["expiration"]) / 1000 > time.time() + 3600:
+            return
+        previous = self.channel
+        self.channel = call_with_backoff(self.service.changes().watch(
+            pageToken=page_token,
+            body={"id": hashlib.sha256(os.urandom(32)).hexdigest()[:32],
+                  "type": "web_hook",
+                  "address": self.address,
+                  "token": self.token,
+                  "expiration": int((time.time() + 7 * 24 * 3600) * 1000)}).execute)
+        print(f"WATCH: PUSH CHANNEL {self.channel['id']} OPEN UNTIL {time.ctime(int(self.channel['expiration']) / 1000)}")
+        if previous is not None:
+            self.stop(previous)
+
+    def stop(self, channel:dict=None):
+        channel = channel or self.channel
+        if channel is None:
+            return
+        try:
+            call_with_backoff(self.service.channels().stop(body={"id": channel["id"], "resourceId": channel["resourceId"]}).execute)
+        except HttpError as error:
+            print(f"WATCH: COULD NOT STOP PUSH CHANNEL {channel['id']}: {error}")
+
+    def close(self):
+        self.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+def watch_pipeline(creds,
+                   warehouse_sink:WarehouseSink,
+                   merged_sink:WarehouseSink,
+                   merged_table:str,
+                   checkpoint_dir:str,
+                   metrics_dir:str,
+                   max_workers:int=4,
+                   stop:threading.Event=None,
+                   on_run=None):
+    """Runs the pipeline whenever the cleaned data or master spreadsheets change, until stop is set.
+
+    The Drive changes feed is polled every WATCH_POLL_SECONDS, or as soon as a push notification
+    arrives when WATCH_WEBHOOK_URL is set. A burst of edits is collected until it has been quiet for
+    WATCH_DEBOUNCE_SECONDS (at most WATCH_MAX_DELAY_SECONDS after its first edit), then only the stale
+    stages and the ones downstream of them run again; the others are restored from their checkpoints.
+    A failed run keeps its changes pending and is retried with exponential backoff, and the page token
+    is only saved once they are applied. on_run(stale_stages, seconds, error) is called after every run.
+    """
+    poll_seconds = getattr(settings, "WATCH_POLL_SECONDS", 30)
+    debounce_seconds = getattr(settings, "WATCH_DEBOUNCE_SECONDS", 10)
+    max_delay_seconds = getattr(settings, "WATCH_MAX_DELAY_SECONDS", 60)
+    stop = stop or threading.Event()
+    wake = threading.Event()
+    # Stopping interrupts the wait for the next poll
+    threading.Thread(target=lambda: stop.wait() or wake.set(), daemon=True).start()
+    service = drive_service(creds)
+    watcher = DriveChangeWatcher(service,
+                                 getattr(settings, "WATCH_STATE_PATH", os.path.join(".cache", "watch.json")),
+                                 {settings.MASTER_AREA_SPSID, settings.MASTER_INCOME_PROVINCE_SPSID,
+                                  settings.MASTER_YEAR_SPSID, settings.MASTER_INDICATOR_SPSID},
+                                 settings.CLEANED_DATA_DRIVE_FOLDER,
+                                 getattr(settings, "SNAPSHOT_CACHE_DIR", os.path.join(".cache", "snapshots")))
+    webhook_url = getattr(settings, "WATCH_WEBHOOK_URL", None)
+    channel = ChangeNotificationChannel(service, webhook_url, getattr(settings, "WATCH_WEBHOOK_PORT", 8080), wake) if webhook_url else None
+
+    def run(stale_stages:set[str], resume:bool=True) -> Exception | None:
+        RUN_METRICS.reset()
+        run_id = time.strftime("run_%Y%m%d-%H%M%S")
+        print(f"\nWATCH: RUNNING FOR CHANGES IN {', '.join(sorted(stale_stages)) or 'nothing (first run)'}")
+        started_at = time.perf_counter()
+        error = None
+        try:
+            run_stages(build_pipeline(creds, warehouse_sink, merged_sink, merged_table),
+                       checkpoint_dir,
+                       resume=resume,
+                       max_workers=max_workers,
+                       rerun=stale_stages)
+            print(f"WATCH: RUN FINISHED IN {time.perf_counter() - started_at:.1f}s")
+        except Exception as e:
+            # The stages that failed have no checkpoint, the retry picks them up again
+            error = e
+            print(f"WATCH: RUN FAILED: {e}")
+        finally:
+            RUN_METRICS.save(os.path.join(metrics_dir, f"{run_id}.json"))
+        if on_run is not None:
+            on_run(stale_stages, time.perf_counter() - started_at, error)
+        return error
+
+    try:
+        # A new watcher first brings the whole warehouse up to date, a restarted one applies the edits
+        # made while it was down without waiting for the burst to settle
+        full_run = not watcher.start()
+        catch_up = not full_run
+        pending:set[str] = set()
+        first_change_at = last_change_at = None
+        failures, retry_at = 0, None
+        while not stop.is_set():
+            try:
+                if channel is not None:
+                    channel.ensure_registered(watcher.page_token)
+                stale_stages = watcher.poll()
+            except Exception as e:
+                print(f"WATCH: POLLING DRIVE CHANGES FAILED: {e}")
+                stale_stages = set()
+            now = time.monotonic()
+            if stale_stages:
+                pending |= stale_stages
+                first_change_at = first_change_at or now
+                last_change_at = now
+            elif not pending and not full_run:
+                # Nothing left to apply, the changes read so far need not be read again after a restart
+                watcher.save()
+            due_at = None
+            if full_run or (pending and catch_up):
+                due_at = now
+            elif pending:
+                due_at = min(last_change_at + debounce_seconds, first_change_at + max_delay_seconds)
+            if due_at is not None and retry_at is not None:
+                due_at = max(due_at, retry_at)
+            catch_up = False
+            if due_at is not None and now >= due_at:
+                if run(pending, resume=not full_run) is None:
+                    watcher.save()
+                    pending, full_run, first_change_at, last_change_at = set(), False, None, None
+                    failures, retry_at = 0, None
+                else:
+                    failures += 1
+                    retry_seconds = min(max(debounce_seconds, 1.0) * 2 ** (failures - 1), 3600)
+                    retry_at = time.monotonic() + retry_seconds
+                    print(f"WATCH: RETRYING IN {retry_seconds:.0f}s ({failures} FAILED RUN(S))")
+                continue
+            timeout = poll_seconds if due_at is None else min(poll_seconds, max(0.0, due_at - now))
+            wake.wait(timeout)
+            wake.clear()
+    finally:
+        if channel is not None:
+            channel.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NusaData ETL: cleaned Google Sheets to the data warehouse")
+    parser.add_argument("--resume", action="store_true",
+                        help="reuse the stage checkpoints of the previous run and restart from the first stage that did not finish")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="ignore the change data capture state and recompute every row")
+    parser.add_argument("--profile", action="store_true",
+                        help="cProfile every stage and trace memory allocations (stages then run one at a time)")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and refresh the warehouse whenever the source spreadsheets change on Drive")
+    parser.add_argument("--batch", action="store_true",
+                        help="run every warehouse in PIPELINE_CONFIGS at once, sharing quota, clients and master data")
+    args = parser.parse_args()
+    if args.batch and (args.watch or args.profile):
+        parser.error("--batch cannot be combined with --watch or --profile")
+    
+    metrics_dir = getattr(settings, "METRICS_DIR", os.path.join(".cache", "metrics"))
+    run_id = time.strftime("run_%Y%m%d-%H%M%S")
+    profile_dir = os.path.join(metrics_dir, f"{run_id}_profile") if args.profile else None
+    if args.profile:
+        tracemalloc.start()
+    
     # Load settings
     scope = settings.SCOPES
     
     # Get credentials
     print("Loading credentials . . .")
-    creds:Credentials = get_creds("credentials.json", "token.json", scope)
+    creds = get_creds("credentials.json", "token.json", scope, getattr(settings, "SERVICE_ACCOUNT_FILE", None))
     print("Credentials loaded successfully.\n")
     
-    # Get all cleaned data
-    print("\nLoading cleaned data . . .")
-    cleaned_data:list[pd.DataFrame] = get_all_cleaned_data(creds, settings.CLEANED_DATA_DRIVE_FOLDER)
-    print(f"Loaded {len(cleaned_data)} cleaned data files.\n")
-    
-    # Concatenate cleaned data
-    print("\nConcatenating cleaned data . . .")
-    concatenated_df:pd.DataFrame = concatenate_cleaned_data(cleaned_data)
-    print(f"Concatenated data shape: {concatenated_df.shape}\n")
+    if args.batch:
+        summaries = run_batch(creds,
+                              [PipelineConfig(**config) for config in settings.PIPELINE_CONFIGS],
+                              metrics_dir,
+                              max_pipelines=getattr(settings, "BATCH_MAX_PIPELINES", 4),
+                              resume=args.resume,
+                              full_refresh=args.full_refresh)
+        print(f"\nRun metrics of every pipeline written to {metrics_dir}")
+        sys.exit(1 if any(summary["status"] == "failed" for summary in summaries) else 0)
     
-    # Melt cleaned data
-    print("Melting cleaned data . . .")
-    melted_df:pd.DataFrame = melt_cleaned_data(concatenated_df)
-    print(f"Melted data shape: {melted_df.shape}\n")
-    
-    # Get master data
-    print("Loading master data . . .")
-    master_area_df, master_inc_province_df, master_year_df, master_indicator_df = get_master_data(creds, settings.MASTER_WORKSHEET)
-    print(f"Master data loaded successfully.\n")
+    warehouse_sink, merged_sink, merged_table = make_sinks(creds)
+    if args.watch:
+        print("Watching Drive for changes, press Ctrl+C to stop . . .")
+        try:
+            watch_pipeline(creds, warehouse_sink, merged_sink, merged_table,
+                           getattr(settings, "STAGE_CHECKPOINT_DIR", os.path.join(".cache", "stages")),
+                           metrics_dir,
+                           max_workers=getattr(settings, "STAGE_MAX_WORKERS", 4))
+        except KeyboardInterrupt:
+            print("\nStopped watching.")
+        sys.exit(0)
     
-    # Cross merge master data
-    column_to_rename = {
-        "ID":"Area Code",
-        "AREA_NAME":"Area",
-        "Indicator_Code":"Indicator Code",
-        "Indicator_Name":"Indicator Name",
-        "Unit":"Unit"
-    }
-    print("\nCross merging master data . . .")
-    cross_merged_df = cross_merge_master(master_area_df, master_year_df, master_indicator_df, column_to_rename)
-    print(f"Cross merged data shape: {cross_merged_df.shape}\n")
-    
-    # Validate data
-    print("\nValidating data . . .")
-    validate_data_1(cross_merged_df, melted_df)
-    print("Data validation passed.\n")
-    
-    # Left outer merge to master
-    print("\nLeft outer merging cleaned data to master data . . .")
-    result = left_outer_merge_to_master(cross_merged_df, melted_df)
-    print(f"Result shape: {result.shape}\n")
-    
-    # Convert value dataframe
-    print("\nConverting value dataframe . . .")
-    converted_result = convert_value_dataframe(result)
-    print(f"Converted result shape: {converted_result.shape}\n")
-    # Write data to SPS
-    print("\nWriting data to SPS . . .")
-    print(f"Writing {len(converted_result)} rows of data to {settings.MERGED_DATA_SPS_ID} . . .")
-    converted_data_from_sps = write_data_to_sps(creds, settings.MERGED_DATA_SPS_ID, "main",converted_result )
-    print(f"Data written to {settings.MERGED_DATA_SPS_ID} successfully.\n")
-    
-    # Call dimension and fact value
-    print("\nHandling dimension and fact value . . .")
-    converted_and_merged_data = get_dataframe_from_sheet(creds, settings.MERGED_DATA_SPS_ID, "main")
-    dim_location = get_dataframe_from_sheet(creds, settings.WAREHOUSE_DATA_SPS_ID, "dim_location").drop(columns="id")
-    dim_indicator = get_dataframe_from_sheet(creds, settings.WAREHOUSE_DATA_SPS_ID, "dim_indicator").drop(columns="id")
-    dim_year = get_dataframe_from_sheet(creds, settings.WAREHOUSE_DATA_SPS_ID, "dim_year").drop(columns="id")
-    
-    # Handle dim_year
-    print("\nHandling dim_year . . .")
-    final_dim_year = handle_dim_year(creds, dim_year, master_year_df, settings.DEFAULT_NULL_VALUE)
-    print(f"Final dim_year columns: {final_dim_year.columns.tolist()}")
-    print(f"FInal dim_year rows: {len(final_dim_year)}")
-    
-    # Handle dim_location
-    print("\nHandling dim_location . . .")
-    final_dim_location = handle_dim_location(creds, dim_location, master_area_df, master_inc_province_df, settings.DEFAULT_NULL_VALUE)
-    print(f"Final dim_location columns: {final_dim_location.columns.tolist()}")
-    print(f"Final dim_location rows: {len(final_dim_location)}")
-    
-    # Handle dim_indicator
-    print("\nHandling dim_indicator . . .")
-    final_dim_indicator = handle_dim_indicator(creds, dim_indicator, master_indicator_df, settings.DEFAULT_NULL_VALUE)
-    print(f"Final dim_indicator columns: {final_dim_indicator.columns.tolist()}")
-    print(f"Final dim_indicator rows: {len(final_dim_indicator)}")
-    
-    # Handle fact_value
-    print("\nHandling fact_value . . .")
-    final_fact_value = handle_fact_value(creds, 
-                                         converted_and_merged_data,
-                                         final_dim_location,
-                                         final_dim_indicator,
-                                         final_dim_year,
-                                         master_indicator_df)
-    print(f"Final fact_value columns: {final_fact_value.columns.tolist()}")
-    print(f"Final fact_value rows: {len(final_fact_value)}")
-    print(f"Final fact_value not null fact values (value): {final_fact_value.value.notnull().sum()}")
-    print(f"Final fact_value not null fact values (relative): {final_fact_value.relative_value.notnull().sum()}")
+    try:
+        results = run_stages(build_pipeline(creds, warehouse_sink, merged_sink, merged_table, full_refresh=args.full_refresh),
+                             getattr(settings, "STAGE_CHECKPOINT_DIR", os.path.join(".cache", "stages")),
+                             resume=args.resume,
+                             max_workers=getattr(settings, "STAGE_MAX_WORKERS", 4),
+                             profile_dir=profile_dir)
+    finally:
+        # Written for failed runs too, that is when the numbers are needed most
+        RUN_METRICS.save(os.path.join(metrics_dir, f"{run_id}.json"))
+        print(f"\nRun metrics written to {os.path.join(metrics_dir, run_id + '.json')}")
+        if profile_dir is not None:
+            print(f"Stage profiles written to {profile_dir} (open with: python -m pstats <file>)")
     
     print("\n\nAll data handling completed successfully.\n")
     print("Link to Google Sheets (Merged Data): https://docs.google.com/spreadsheets/d/1cxezORckD40WCM2BfZTvYoSEfE2z0Chyu6NheAKWGuo/edit?gid=0#gid=0")
     print("Link to Google Sheets (Warehouse Data): https://docs.google.com/spreadsheets/d/1TyE8fX8_oM6Q05eXXJxhzuPOXl21gnCohYNnB7VEneE/edit?gid=0#gid=0")
-    input("Press Enter to exit . . .")
\ No newline at end of file
+    if sys.stdin.isatty():
+        input("Press Enter to exit . . .")